@@ -1 +1,30 @@
-from backend.main import app
+"""
+Entrada da Vercel: vercel.json manda /api/* para cá.
+
+O backend importa os próprios módulos pelo nome (import models), então a
+pasta entra no sys.path, e o /api vira root_path, como atrás de um proxy
+com prefixo. SERVERLESS=1 liga o modo descrito em backend/config.py, com a
+DATABASE_URL configurada no projeto. O main é importado uma vez por
+instância: engines, pools e o snapshot do catálogo ficam para as invocações
+quentes seguintes. Sem threads de fila: as notas e os documentos saem dentro
+da requisição, e o cron de vercel.json chama /api/jobs/drain para as
+retentativas (configure CRON_SECRET no projeto).
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("SERVERLESS", "1")
+
+import main  # noqa: E402
+
+PREFIX = "/api"
+
+
+async def app(scope, receive, send):
+    # ASGI keeps the full path and names the mount point in root_path;
+    # Starlette matches the routes on what comes after it
+    if scope["type"] in ("http", "websocket") and scope["path"].startswith(PREFIX) and not scope.get("root_path"):
+        scope = {**scope, "root_path": PREFIX}
+    await main.app(scope, receive, send)
@@ -1,9 +1,12 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
-import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
 import os
 from dotenv import load_dotenv
+from cache import TTLCache
+import models
 
 load_dotenv()
 
@@ -12,7 +15,35 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-me-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Authenticated users by JWT subject, so polling requests skip the users SELECT.
+# Updates/deletes through the ORM clear it; the TTL bounds staleness for
+# changes made by other processes (create_user.py, other workers).
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# bcrypt work factor for new hashes. Changing it is safe: hashes with another
+# cost still verify and are rewritten on the user's next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt runs in its own small pool so logins never block the event loop nor
+# starve the threadpool used by the regular sync routes. Past
+# LOGIN_WORKERS + LOGIN_QUEUE_LIMIT pending checks, new logins are refused.
+LOGIN_WORKERS = int(os.getenv("LOGIN_WORKERS", "4"))
+LOGIN_QUEUE_LIMIT = int(os.getenv("LOGIN_QUEUE_LIMIT", "32"))
+
+_password_pool = ThreadPoolExecutor(max_workers=LOGIN_WORKERS, thread_name_prefix="bcrypt")
+_password_slots = threading.BoundedSemaphore(LOGIN_WORKERS + LOGIN_QUEUE_LIMIT)
+
+class PasswordPoolSaturated(Exception):
+    pass
+
+# jose and bcrypt are imported on first use: they cost ~50 ms of cold start
+# and most serverless invocations never check a password
+
 def verify_password(plain_password, hashed_password):
+    import bcrypt
+
     # bcrypt.checkpw requires bytes
     if isinstance(plain_password, str):
         plain_password = plain_password.encode('utf-8')
@@ -22,12 +53,37 @@ def verify_password(plain_password, hashed_password):
     return bcrypt.checkpw(plain_password, hashed_password)
 
 def get_password_hash(password):
+    import bcrypt
+
     if isinstance(password, str):
         password = password.encode('utf-8')
     # bcrypt.hashpw returns bytes
-    return bcrypt.hashpw(password, bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def needs_rehash(hashed_password: str) -> bool:
+    # Hash format: $2b$<cost>$<salt+digest>
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+async def _run_in_password_pool(fn, *args):
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordPoolSaturated()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, fn, *args)
+    finally:
+        _password_slots.release()
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_in_password_pool(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_in_password_pool(get_password_hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -36,3 +92,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+def decode_access_token(token: str) -> Optional[dict]:
+    """Claims de um token válido (com "sub"), ou None."""
+    from jose import JWTError, jwt
+
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return claims if claims.get("sub") else None
+
+def tenant_of(claims: dict) -> int:
+    # Tokens issued before multi-tenancy carry no "tenant" claim
+    return int(claims.get("tenant", models.DEFAULT_TENANT_ID))
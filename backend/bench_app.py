@@ -0,0 +1,318 @@
+"""
+Benchmark da API inteira, para comparar commits.
+
+Sobe o app (uvicorn numa thread deste processo) sobre um SQLite temporário e
+o focus_stub.py no modo webhook: a emissão passa pela fila, o stub responde
+"processando_autorizacao" e a autorização volta por callback em
+/webhook/focus, repetido como a Focus faz. Não toca no erp.db nem na Focus.
+
+Cada cenário roda sozinho por alguns segundos com N clientes HTTP
+(keep-alive, um processo cada, para não disputarem o GIL com o app) e depois
+todos juntos (misto):
+
+    venda      POST /sales                 (process_sale)
+    produtos   GET /products/              (read_products, keyset)
+    busca      GET /products/search        (FTS5)
+    emissao    POST /fiscal/issue-manual   (issue_manual_invoice)
+    webhook    POST /webhook/focus         (callbacks repetidos e fora de ordem)
+    login      POST /token + GET /users/me (bcrypt e cache de usuários)
+
+O resultado sai em JSON: vazão, p50/p95/p99 medidos no cliente e queries
+por requisição lidas do /metrics do próprio app.
+
+Usage: python bench_app.py [--seconds 5] [--clients 8] [--focus-latency 0.05]
+                           [--only venda,produtos] [--output resultado.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+CATALOG_SIZE = 2000
+USERNAME, PASSWORD = "bench", "bench-senha"
+
+COMPANY = {
+    "cnpj": "12.345.678/0001-90", "ie": "123456789", "razao_social": "Bench LTDA", "nome_fantasia": "Bench",
+    "logradouro": "Rua A", "numero": "1", "bairro": "Centro", "municipio": "Florianópolis", "uf": "SC",
+    "cep": "88000000", "regime_tributario": 1,
+}
+MANUAL_INVOICE = {
+    "nome": "Cliente Bench", "cpf_cnpj": "123.456.789-01", "logradouro": "Rua B", "numero": "2",
+    "bairro": "Centro", "municipio": "Curitiba", "uf": "PR", "cep": "80000000",
+    "item_nome": "Produto", "item_ncm": "85171231", "item_cfop": "6102", "item_price": 10.0, "item_quantity": 1,
+}
+
+# Which /metrics routes each scenario hits, for queries per request
+ROUTES = {
+    "venda": [("POST", "/sales")],
+    "produtos": [("GET", "/products/")],
+    "busca": [("GET", "/products/search")],
+    "emissao": [("POST", "/fiscal/issue-manual")],
+    "webhook": [("POST", "/webhook/focus")],
+    "login": [("POST", "/token"), ("GET", "/users/me")],
+}
+MIX = {"venda": 40, "produtos": 25, "busca": 15, "emissao": 8, "webhook": 10, "login": 2}
+
+METRIC_LINE = re.compile(r'^erp_http_request_db_queries_(sum|count)\{method="([^"]+)",route="([^"]+)"\} (\S+)$')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__) or "."
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def start_app(args, tmp):
+    """Configura o ambiente, sobe stub e app. Retorna (base_url, server, thread, stub_state)."""
+    from focus_stub import start_stub
+
+    app_port = free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+    stub, stub_state = start_stub(
+        latency=args.focus_latency,
+        webhook_url=f"{base_url}/webhook/focus", webhook_delay=args.webhook_delay, webhook_copies=2,
+    )
+    # config.py reads these at import: set them before the app is imported
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+        "DOCUMENTS_DIR": os.path.join(tmp, "documentos"),
+        "FOCUS_NFE_URL": f"http://127.0.0.1:{stub.server_port}/v2",
+        "FOCUS_NFE_TOKEN": "bench-token",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+
+    import uvicorn
+
+    import auth
+    import init_db
+    import main
+    import models
+    from database import SessionLocal
+
+    init_db.create_tables()
+    with SessionLocal() as db:
+        db.execute(
+            models.Product.__table__.insert(),
+            [{"name": f"Produto {i:05d}", "ncm": "85171231", "quantity": 10**9, "price": 10.0} for i in range(CATALOG_SIZE)],
+        )
+        db.add(models.User(username=USERNAME, hashed_password=auth.get_password_hash(PASSWORD), full_name="Bench"))
+        db.commit()
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=app_port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return base_url, server, thread, stub_state
+
+
+class Scenarios:
+    """Uma requisição de cada cenário; cada cliente tem o seu gerador aleatório."""
+
+    def __init__(self, client, rng, issued):
+        self.client = client
+        self.rng = rng
+        self.issued = issued  # refs issued so far, shared by the webhook scenario
+
+    def venda(self):
+        items = [{"product_id": self.rng.randint(1, CATALOG_SIZE), "quantity": 1} for _ in range(self.rng.randint(1, 5))]
+        return self.client.post("/sales", json={"items": items})
+
+    def produtos(self):
+        return self.client.get("/products/", params={"limit": 50, "after_id": self.rng.randrange(CATALOG_SIZE - 50)})
+
+    def busca(self):
+        return self.client.get("/products/search", params={"q": f"produto {self.rng.randrange(100):02d}"})
+
+    def emissao(self):
+        response = self.client.post("/fiscal/issue-manual", json=MANUAL_INVOICE)
+        if response.status_code == 200:
+            self.issued.append(response.json()["ref"])
+        return response
+
+    def webhook(self):
+        # Resent and late callbacks for notes already issued, as after a SEFAZ outage
+        ref = self.rng.choice(self.issued) if self.issued else f"bench-{self.rng.randrange(1000)}"
+        status = self.rng.choice(["autorizado", "autorizado", "processando_autorizacao"])
+        return self.client.post("/webhook/focus", json={"ref": ref, "status": status, "protocolo": "1"})
+
+    def login(self):
+        response = self.client.post("/token", data={"username": USERNAME, "password": PASSWORD})
+        if response.status_code != 200:
+            return response
+        token = response.json()["access_token"]
+        return self.client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+
+
+def client_loop(base_url, headers, weights, seconds, seed, issued):
+    """Roda num processo cliente. Retorna (latências, erros, refs emitidas) por cenário."""
+    import httpx
+
+    rng = random.Random(seed)
+    names, shares = list(weights), list(weights.values())
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    with httpx.Client(base_url=base_url, timeout=30, headers=headers) as client:
+        scenarios = Scenarios(client, rng, list(issued))
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, shares)[0]
+            start = time.perf_counter()
+            try:
+                ok = getattr(scenarios, name)().status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                samples[name].append(time.perf_counter() - start)
+            else:
+                errors[name] += 1
+    return samples, errors, scenarios.issued[len(issued):]
+
+
+def db_queries(base_url):
+    """(method, route) -> (soma, contagem) de erp_http_request_db_queries."""
+    import httpx
+
+    totals = {}
+    for line in httpx.get(f"{base_url}/metrics").text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, method, route, value = match.groups()
+            entry = totals.setdefault((method, route), [0.0, 0.0])
+            entry[0 if kind == "sum" else 1] += float(value)
+    return totals
+
+
+def percentile(values, p):
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2) if values else None
+
+
+def run_phase(pool, base_url, headers, weights, args, issued):
+    before = db_queries(base_url)
+    results = pool.starmap(
+        client_loop,
+        [(base_url, headers, weights, args.seconds, args.seed + i, issued) for i in range(args.clients)],
+        chunksize=1,
+    )
+    after = db_queries(base_url)
+    for _, _, refs in results:
+        issued.extend(refs)
+
+    report = {}
+    for name in weights:
+        latencies = sorted(s for samples, _, _ in results for s in samples[name])
+        queries = count = 0.0
+        for key in ROUTES[name]:
+            total_after, count_after = after.get(key, (0.0, 0.0))
+            total_before, count_before = before.get(key, (0.0, 0.0))
+            queries += total_after - total_before
+            count += count_after - count_before
+        report[name] = {
+            "requests": len(latencies),
+            "errors": sum(errors[name] for _, errors, _ in results),
+            # Every client runs for exactly args.seconds
+            "throughput_rps": round(len(latencies) / args.seconds, 1),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "queries_per_request": round(queries / count, 2) if count else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da API com stub da Focus NFe")
+    parser.add_argument("--seconds", type=float, default=5, help="duração de cada fase")
+    parser.add_argument("--clients", type=int, default=8, help="clientes HTTP simultâneos")
+    parser.add_argument("--focus-latency", type=float, default=0.05, help="latência do stub da Focus (s)")
+    parser.add_argument("--webhook-delay", type=float, default=0.2, help="segundos até o callback de autorização")
+    parser.add_argument("--only", help="cenários separados por vírgula (padrão: todos)")
+    parser.add_argument("--no-mix", action="store_true", help="pula a fase mista")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="grava o JSON neste arquivo além de imprimir")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(MIX)
+    unknown = set(names) - set(MIX)
+    if unknown:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_url, server, thread, stub = start_app(args, tmp)
+        import httpx
+
+        # Branch routes take the tenant from the token (TENANT_REQUIRED)
+        token = httpx.post(f"{base_url}/token", data={"username": USERNAME, "password": PASSWORD}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        httpx.post(f"{base_url}/settings/company", json=COMPANY, headers=headers).raise_for_status()
+
+        issued = []
+        scenarios = {}
+        # spawn: the clients must not inherit the app's threads and connections
+        with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+            for name in names:
+                scenarios[name] = run_phase(pool, base_url, headers, {name: 1}, args, issued)[name]
+            mixed = None if args.no_mix else run_phase(pool, base_url, headers, {n: MIX[n] for n in names}, args, issued)
+
+        # Let the emission queue and the stub callbacks settle before reading the backlog
+        time.sleep(args.webhook_delay + 1)
+        import models
+        from database import SessionLocal
+
+        with SessionLocal() as db:
+            backlog = {
+                "emission_queue": db.query(models.EmissionJob).count(),
+                # The rest are reconciliation polls of notes Focus already accepted
+                "emission_unsent": db.query(models.EmissionJob)
+                .join(models.Invoice, models.Invoice.ref == models.EmissionJob.ref)
+                .filter(models.Invoice.status == "processando").count(),
+                "document_queue": db.query(models.DocumentJob).count(),
+                "invoices_processando": db.query(models.Invoice).filter(
+                    models.Invoice.status.in_(["processando", "processando_autorizacao"])
+                ).count(),
+            }
+        # Runs the lifespan shutdown (pending webhooks, workers) before the temp dir goes away
+        server.should_exit = True
+        thread.join()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": {
+            "seconds": args.seconds, "clients": args.clients, "focus_latency": args.focus_latency,
+            "webhook_delay": args.webhook_delay, "catalog_size": CATALOG_SIZE, "seed": args.seed,
+        },
+        "scenarios": scenarios,
+        "mixed": mixed,
+        "focus_stub": {"requests": len(stub.requests), "webhooks_sent": stub.webhooks_sent,
+                       "webhook_errors": stub.webhook_errors},
+        "backlog": backlog,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
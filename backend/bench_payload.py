@@ -0,0 +1,66 @@
+"""
+Micro-benchmark do payload_builder: tempo para montar o payload de notas com
+1 a 10 mil itens (intra e interestadual), sem I/O.
+
+Usage: python bench_payload.py [repeticoes]
+"""
+import json
+import sys
+import time
+
+import payload_builder
+
+ITEM_COUNTS = [1, 100, 1000, 10_000]
+
+
+class Recipient:
+    cpf_cnpj = "12.345.678/0001-90"
+    nome = "Distribuidora Exemplo"
+    logradouro = "Rua das Flores"
+    numero = "100"
+    bairro = "Centro"
+    municipio = "Curitiba"
+    cep = "80000-000"
+    telefone = ""
+    indicador_inscricao_estadual = "1"
+    inscricao_estadual = "1234567890"
+    codigo_municipio = "4106902"
+
+    def __init__(self, uf):
+        self.uf = uf
+
+
+def lines(count):
+    return [
+        payload_builder.Line(f"SKU{i:05d}", f"Produto {i}", "85171231", "5102" if i % 3 else "5405", 1 + i % 7, 9.9 + i % 50)
+        for i in range(count)
+    ]
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    emitter = payload_builder.compile_emitter("12.345.678/0001-00", "sc", 1)
+
+    print(f"{'itens':>7} | {'intra ms':>9} | {'inter ms':>9} | {'+json ms':>9}")
+    for count in ITEM_COUNTS:
+        items = lines(count)
+        intra = payload_builder.manual_recipient(Recipient("SC"))
+        inter = payload_builder.manual_recipient(Recipient("PR"))
+        intra_ms = median_ms(lambda: payload_builder.build_payload(emitter, items, intra), repeat)
+        inter_ms = median_ms(lambda: payload_builder.build_payload(emitter, items, inter), repeat)
+        json_ms = median_ms(lambda: json.dumps(payload_builder.build_payload(emitter, items, inter)[0]), repeat)
+        print(f"{count:>7} | {intra_ms:>9.3f} | {inter_ms:>9.3f} | {json_ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark de POST /sales: baixa de estoque antiga (2 SELECTs por item + flush
+do ORM) contra o motor em lote de sales.py (1 SELECT IN + UPDATEs condicionais).
+
+Usa um banco SQLite temporário, não toca no erp.db.
+
+Usage: python bench_sales.py [repeticoes]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import models
+import sales
+import schemas
+
+CART_SIZES = [1, 10, 100, 1000]
+CATALOG_SIZE = 5000
+
+
+def legacy_process_sale(db, items):
+    # Copy of the original process_sale body, kept here for comparison
+    for item in items:
+        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
+        if not product:
+            raise Exception(f"Product {item.product_id} not found")
+        if product.quantity < item.quantity:
+            raise Exception(f"Insufficient stock for product {product.name}")
+
+    for item in items:
+        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
+        product.quantity -= item.quantity
+
+    db.commit()
+
+
+def batched_process_sale(db, items):
+    sales.deduct_stock(db, models.DEFAULT_TENANT_ID, items)
+    db.commit()
+
+
+def setup_db(path):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            models.Product.__table__.insert(),
+            [{"name": f"Produto {i}", "quantity": 10**9, "price": 10.0} for i in range(CATALOG_SIZE)],
+        )
+
+    counter = {"statements": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter["statements"] += 1
+
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine), counter
+
+
+def run(fn, Session, counter, cart_size, repeat):
+    items = [schemas.SaleItemCreate(product_id=i + 1, quantity=1) for i in range(cart_size)]
+    timings = []
+    counter["statements"] = 0
+    for _ in range(repeat):
+        db = Session()
+        try:
+            start = time.perf_counter()
+            fn(db, items)
+            timings.append(time.perf_counter() - start)
+        finally:
+            db.close()
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, counter["statements"] / repeat
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, Session, counter = setup_db(os.path.join(tmp, "bench.db"))
+
+        print(f"{'itens':>6} | {'antigo ms':>10} {'stmts':>6} | {'lote ms':>10} {'stmts':>6} | {'ganho':>6}")
+        for size in CART_SIZES:
+            legacy_ms, legacy_stmts = run(legacy_process_sale, Session, counter, size, repeat)
+            batched_ms, batched_stmts = run(batched_process_sale, Session, counter, size, repeat)
+            print(
+                f"{size:>6} | {legacy_ms:>10.2f} {legacy_stmts:>6.0f} | "
+                f"{batched_ms:>10.2f} {batched_stmts:>6.0f} | {legacy_ms / batched_ms:>5.1f}x"
+            )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
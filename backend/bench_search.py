@@ -0,0 +1,124 @@
+"""
+Benchmark de GET /products/search (índice FTS5) num catálogo de 100k produtos.
+
+Mede a latência de products.search_products por consulta digitada no PDV,
+separando as seletivas (o bm25 ranqueia todos os que casam) das amplas (um
+prefixo curto que casa com milhares de produtos: só os
+products.SEARCH_CANDIDATES mais novos são ranqueados), e confere se os
+resultados são os melhores do bm25 entre esses candidatos. Falha (exit 1) se
+algum resultado estiver fora do ranking ou se o p99 do conjunto de consultas
+passar do orçamento. Usa um SQLite temporário com os mesmos PRAGMAs do app.
+
+Usage: python bench_search.py [produtos] [consultas]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+import products
+
+P99_BUDGET_MS = 5.0
+
+KINDS = ["Capa", "Película", "Carregador", "Cabo", "Fone", "Tela", "Bateria", "Suporte", "Caixa de Som", "Adaptador"]
+BRANDS = ["iPhone", "Samsung", "Motorola", "Xiaomi", "LG", "Asus", "Nokia", "Positivo"]
+DETAILS = ["Silicone", "Vidro Temperado", "Turbo", "USB-C", "Lightning", "Bluetooth", "Magnético", "Anti-impacto", "Original", "Genérico"]
+NCMS = ["85171231", "85044010", "85176294", "85183000", "39269090", "85076000"]
+
+QUERIES = ["cap", "capa sam", "pelicula", "película iph", "carreg turbo", "cabo usb", "fone blue",
+           "bateria moto", "8517", "85044010", "tela xiao", "magnetico", "anti", "suporte", "caixa de som lg",
+           "capa sam sil", "capa sam sil 12", "carreg moto turbo 52"]
+
+
+def setup_db(path, size):
+    # Same pragmas as the app (WAL, mmap, cache_size): the index outgrows the default page cache
+    engine = database.make_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    rows = [
+        {
+            "name": f"{rng.choice(KINDS)} {rng.choice(BRANDS)} {rng.choice(DETAILS)} {i}",
+            "quantity": rng.randint(0, 50),
+            "price": round(rng.uniform(5, 500), 2),
+            "ncm": rng.choice(NCMS),
+        }
+        for i in range(size)
+    ]
+    with engine.begin() as conn:
+        conn.execute(models.Product.__table__.insert(), rows)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def all_ranks(db, query):
+    """{id: bm25} de todos os produtos que casam com a consulta."""
+    rows = db.execute(
+        text("SELECT rowid, rank FROM products_fts WHERE products_fts MATCH :match"),
+        {"match": products.fts_query(query)},
+    )
+    return dict(rows.all())
+
+
+def check_ranking(db, query, limit=20) -> bool:
+    """
+    Os `limit` resultados têm os melhores bm25 entre os SEARCH_CANDIDATES
+    produtos mais novos que casam, ou seja, entre todos quando a consulta casa
+    com menos que isso (empates em qualquer ordem).
+    """
+    ranks = all_ranks(db, query)
+    candidates = sorted(ranks, reverse=True)[:products.SEARCH_CANDIDATES]
+    got = [ranks[row["id"]] for row in products.search_products(db, models.DEFAULT_TENANT_ID, query, limit)]
+    return got == sorted(ranks[rowid] for rowid in candidates)[:limit]
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        engine, Session = setup_db(os.path.join(tmp, "bench.db"), size)
+        print(f"catálogo: {size} produtos indexados em {time.perf_counter() - start:.1f}s")
+
+        db = Session()
+        rng = random.Random(7)
+        timings = {False: [], True: []}
+        try:
+            broad = {query: len(all_ranks(db, query)) > products.SEARCH_CANDIDATES for query in QUERIES}
+            wrong = [query for query in QUERIES if not check_ranking(db, query)]
+            for _ in range(rounds):
+                query = rng.choice(QUERIES)
+                start = time.perf_counter()
+                products.search_products(db, models.DEFAULT_TENANT_ID, query, 20)
+                timings[broad[query]].append((time.perf_counter() - start) * 1000)
+        finally:
+            db.close()
+            engine.dispose()
+
+    failed = bool(wrong)
+    if wrong:
+        print(f"❌ fora do ranking bm25: {', '.join(wrong)}")
+    for label, values in (("seletivas", timings[False]), ("amplas", timings[True])):
+        values = sorted(values)
+        if values:
+            p50, p95, p99 = (percentile(values, p) for p in (0.50, 0.95, 0.99))
+            print(f"{label}: {len(values)}  p50={p50:.2f}ms  p95={p95:.2f}ms  p99={p99:.2f}ms")
+    values = sorted(timings[False] + timings[True])
+    p50, p95, p99 = (percentile(values, p) for p in (0.50, 0.95, 0.99))
+    print(f"todas: {len(values)}  p50={p50:.2f}ms  p95={p95:.2f}ms  p99={p99:.2f}ms  (orçamento p99 {P99_BUDGET_MS}ms)")
+    failed = failed or p99 > P99_BUDGET_MS
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
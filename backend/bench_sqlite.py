@@ -0,0 +1,142 @@
+"""
+Teste de carga de escrita no SQLite: modo padrão (rollback journal, BEGIN
+DEFERRED do pysqlite) contra o perfil de produção de database.tune_sqlite
+(WAL, synchronous=NORMAL, busy_timeout e BEGIN IMMEDIATE nas escritas).
+
+Threads simulam caixas fechando vendas (sales.record_sale), webhooks da
+Focus atualizando notas (lê e depois grava, o caso que mais dá "database is
+locked") e telas listando produtos, todas ao mesmo tempo. Usa um banco
+temporário, não toca no erp.db.
+
+Usage: python bench_sqlite.py [segundos] [caixas]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+import products
+import sales
+import schemas
+
+CATALOG_SIZE = 1000
+INVOICES = 1000
+WEBHOOK_THREADS = 4
+READER_THREADS = 4
+
+
+def setup_db(path, tuned, connections):
+    # One connection per thread: measure SQLite, not waits on the pool
+    engine = database.make_engine(f"sqlite:///{path}", tuned=tuned, pool_size=connections, max_overflow=0)
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            models.Product.__table__.insert(),
+            [{"name": f"Produto {i}", "quantity": 10**9, "price": 10.0} for i in range(CATALOG_SIZE)],
+        )
+        conn.execute(
+            models.Invoice.__table__.insert(),
+            [{"ref": f"nota-{i}", "status": "processando", "total_value": 10.0} for i in range(INVOICES)],
+        )
+    read = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    write = sessionmaker(
+        autocommit=False, autoflush=False,
+        bind=engine.execution_options(**{database.SQLITE_BEGIN: "IMMEDIATE"}) if tuned else engine,
+    )
+    return engine, read, write
+
+
+def sale(db, rng):
+    items = [schemas.SaleItemCreate(product_id=rng.randint(1, CATALOG_SIZE), quantity=1) for _ in range(3)]
+    sales.record_sale(db, models.DEFAULT_TENANT_ID, items)
+    db.commit()
+
+
+def webhook(db, rng):
+    ref = f"nota-{rng.randrange(INVOICES)}"
+    status = db.execute(select(models.Invoice.status).where(models.Invoice.ref == ref)).scalar()
+    db.execute(
+        update(models.Invoice)
+        .where(models.Invoice.ref == ref)
+        .values(status="autorizado" if status == "processando" else "processando")
+    )
+    db.commit()
+
+
+def listing(db, rng):
+    products.list_products(db, models.DEFAULT_TENANT_ID, 100, after_id=rng.randrange(CATALOG_SIZE - 100))
+    db.rollback()
+
+
+def worker(fn, Session, stop, results, seed):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        with Session() as db:
+            try:
+                fn(db, rng)
+            except OperationalError:  # database is locked
+                db.rollback()
+                errors += 1
+                continue
+        latencies.append(time.perf_counter() - start)
+    results.append((fn.__name__, latencies, errors))
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+def run(tuned, seconds, cashiers):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, read, write = setup_db(
+            os.path.join(tmp, "bench.db"), tuned, cashiers + WEBHOOK_THREADS + READER_THREADS
+        )
+        stop, results = threading.Event(), []
+        plan = [(sale, write)] * cashiers + [(webhook, write)] * WEBHOOK_THREADS + [(listing, read)] * READER_THREADS
+        threads = [
+            threading.Thread(target=worker, args=(fn, Session, stop, results, seed))
+            for seed, (fn, Session) in enumerate(plan)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    summary = {}
+    for name, latencies, errors in results:
+        entry = summary.setdefault(name, {"latencies": [], "errors": 0})
+        entry["latencies"] += latencies
+        entry["errors"] += errors
+    mode = "tuned" if tuned else "padrão"
+    for name, entry in summary.items():
+        latencies = sorted(entry["latencies"])
+        print(
+            f"{mode:>7} | {name:>8} | {len(latencies) / seconds:>8.1f} | {entry['errors']:>6} | "
+            f"{percentile(latencies, 0.5):>7.1f} | {percentile(latencies, 0.99):>7.1f}"
+        )
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cashiers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    print(f"{cashiers} caixas, {WEBHOOK_THREADS} webhooks, {READER_THREADS} leitores, {seconds:.0f}s por modo")
+    print(f"{'modo':>7} | {'carga':>8} | {'ops/s':>8} | {'locked':>6} | {'p50 ms':>7} | {'p99 ms':>7}")
+    run(False, seconds, cashiers)
+    run(True, seconds, cashiers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Snapshot somente leitura do catálogo de cada filial, gerado no deploy.
+
+GET /catalog serve este arquivo sem abrir o banco: no serverless a tela de
+vendas carrega o catálogo sem pagar conexão nem query a cada cold start. A
+resposta é da filial do token, então só o navegador a guarda (private); a CDN
+só guarda a da filial padrão servida sem token (TENANT_REQUIRED=0), por
+CATALOG_MAX_AGE segundos. O snapshot leva o que
+muda pouco (nome, NCM, CFOP, unidade, preço); estoque continua vindo de
+GET /products/. Gere de novo quando preços ou produtos mudarem.
+
+Grava um arquivo por filial ao lado de CATALOG_SNAPSHOT (catalog.json ->
+catalog-1.json, catalog-2.json...) e uma cópia .gz de cada, já comprimida,
+trocando os arquivos de uma vez (os.replace): quem está servindo nunca lê
+pela metade.
+
+Usage: python catalog.py [tenant_id ...]   (padrão: todas as filiais com produtos)
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+import logs
+import models
+from config import settings
+from database import SessionLocal
+from export import EXPORT_CHUNK_ROWS
+
+log = logging.getLogger(__name__)
+
+products_table = models.Product.__table__
+
+# Stock changes with every sale and is left out
+SNAPSHOT_COLUMNS = ["id", "name", "ncm", "cfop", "unit", "price"]
+
+
+def snapshot_path(tenant_id: int) -> str:
+    root, ext = os.path.splitext(settings.CATALOG_SNAPSHOT)
+    return f"{root}-{tenant_id}{ext}"
+
+
+def tenants(db) -> list:
+    return list(db.scalars(select(products_table.c.tenant_id).distinct().order_by(products_table.c.tenant_id)))
+
+
+def build(db, tenant_id: int) -> bytes:
+    """JSON do catálogo inteiro da filial, por ordem de id."""
+    query = (
+        select(*(products_table.c[name] for name in SNAPSHOT_COLUMNS))
+        .where(products_table.c.tenant_id == tenant_id)
+        .order_by(products_table.c.id)
+        .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    )
+    rows = [dict(row) for row in db.execute(query).mappings()]
+    snapshot = {
+        "tenant_id": tenant_id,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "count": len(rows),
+        "products": rows,
+    }
+    return json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _replace(path: str, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".catalog-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)  # Shipped with the deploy, not a secret
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def write(db, tenant_id: int) -> int:
+    """Gera o snapshot da filial a partir do banco. Retorna a quantidade de produtos."""
+    body = build(db, tenant_id)
+    path = snapshot_path(tenant_id)
+    # The .gz first: a reader that sees the new JSON finds a matching .gz
+    _replace(path + ".gz", gzip.compress(body, compresslevel=9, mtime=0))
+    _replace(path, body)
+    return json.loads(body)["count"]
+
+
+class Snapshot:
+    """Corpo e ETag do arquivo, lidos uma vez por processo e de novo só se o arquivo mudar."""
+
+    __slots__ = ("body", "gzipped", "etag", "mtime")
+
+    def __init__(self, body: bytes, gzipped: Optional[bytes], mtime: float):
+        self.body = body
+        self.gzipped = gzipped
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.mtime = mtime
+
+
+class SnapshotCache:
+    def __init__(self, path: str):
+        self.path = path
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[Snapshot]:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.mtime == mtime:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.mtime != mtime:
+                with open(self.path, "rb") as f:
+                    body = f.read()
+                try:
+                    with open(self.path + ".gz", "rb") as f:
+                        gzipped = f.read()
+                except FileNotFoundError:
+                    gzipped = None
+                self._snapshot = Snapshot(body, gzipped, mtime)
+            return self._snapshot
+
+
+_caches: Dict[int, SnapshotCache] = {}
+
+
+def snapshot_for(tenant_id: int) -> Optional[Snapshot]:
+    """Snapshot da filial, ou None se não foi gerado."""
+    cache = _caches.get(tenant_id)
+    if cache is None:
+        cache = _caches.setdefault(tenant_id, SnapshotCache(snapshot_path(tenant_id)))
+    return cache.get()
+
+
+if __name__ == "__main__":
+    logs.configure()
+    with SessionLocal() as db:
+        for tenant_id in [int(arg) for arg in sys.argv[1:]] or tenants(db):
+            count = write(db, tenant_id)
+            log.info("📦 Snapshot do catálogo da filial %s: %s produtos em %s", tenant_id, count, snapshot_path(tenant_id))
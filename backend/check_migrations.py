@@ -0,0 +1,96 @@
+"""
+Confere as migrações contra os bancos SQLite versionados no repositório.
+
+Copia cada banco para uma pasta temporária, roda `python init_db.py` nele
+(duas vezes: a segunda tem que ser um no-op) e falha (exit 1) se o banco não
+chegar ao head, se manual_invoices não virar view, se alguma nota manual
+sumir de invoices ou se produtos ficarem fora do índice de busca. Os
+originais não são tocados.
+
+Usage: python check_migrations.py [banco.db ...]   (padrão: os dois erp.db do repositório)
+"""
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TRACKED_DATABASES = [
+    os.path.join(BACKEND_DIR, "..", "erp.db"),
+    os.path.join(BACKEND_DIR, "erp.db"),
+]
+
+
+def head_revision() -> str:
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(Config(os.path.join(BACKEND_DIR, "alembic.ini"))).get_current_head()
+
+
+def snapshot(conn) -> dict:
+    """O que a migração não pode perder: produtos e refs das notas manuais."""
+    objects = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')"))
+    manual = set()
+    if objects.get("manual_invoices") == "table":
+        manual = {ref for (ref,) in conn.execute("SELECT ref FROM manual_invoices WHERE ref IS NOT NULL")}
+    products = conn.execute("SELECT count(*) FROM products").fetchone()[0] if "products" in objects else 0
+    return {"objects": objects, "manual": manual, "products": products}
+
+
+def check(path: str, head: str) -> list:
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, os.path.basename(path))
+        shutil.copyfile(path, copy)
+        with sqlite3.connect(copy) as conn:
+            before = snapshot(conn)
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{copy}", "DOCUMENTS_DIR": os.path.join(tmp, "documentos")}
+        for run in (1, 2):
+            result = subprocess.run(
+                [sys.executable, "init_db.py"], capture_output=True, text=True, env=env, cwd=BACKEND_DIR,
+            )
+            if result.returncode != 0:
+                return [f"init_db.py (rodada {run}) falhou:\n{result.stderr[-2000:]}"]
+
+        with sqlite3.connect(copy) as conn:
+            version = conn.execute("SELECT version_num FROM alembic_version").fetchone()
+            if version is None or version[0] != head:
+                problems.append(f"versão {version and version[0]}, esperado {head}")
+            kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'manual_invoices'").fetchone()
+            if kind is None or kind[0] != "view":
+                problems.append(f"manual_invoices é {kind and kind[0]}, esperado view")
+            merged = {ref for (ref,) in conn.execute("SELECT ref FROM invoices WHERE source = 'manual'")}
+            if before["manual"] - merged:
+                problems.append(f"{len(before['manual'] - merged)} notas manuais fora de invoices")
+            products = conn.execute("SELECT count(*) FROM products").fetchone()[0]
+            indexed = conn.execute("SELECT count(*) FROM products_fts_docsize").fetchone()[0]
+            if products != before["products"]:
+                problems.append(f"produtos: {before['products']} antes, {products} depois")
+            if indexed != products:
+                problems.append(f"índice de busca com {indexed} de {products} produtos")
+    return problems
+
+
+def main():
+    paths = sys.argv[1:] or TRACKED_DATABASES
+    head = head_revision()
+    failed = False
+    for path in paths:
+        problems = check(path, head)
+        name = os.path.relpath(path, os.path.dirname(BACKEND_DIR))
+        if problems:
+            failed = True
+            for problem in problems:
+                print(f"❌ {name}: {problem}")
+        else:
+            print(f"✅ {name}: migrado até {head}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Orçamento do tempo de import do app (cold start no serverless, reinício dos workers).
+
+Importa o main.py em processos Python novos, várias vezes, e falha (exit 1)
+se o melhor tempo passar do orçamento, se o import abrir o banco ou se
+carregar alguma dependência que só deveria vir no primeiro uso (requests,
+jose, bcrypt, alembic). Na falha mostra os módulos mais lentos segundo
+`python -X importtime`. Usa um SQLite temporário.
+
+Usage: python check_startup.py [orçamento_ms] [rodadas]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "900"))
+
+# Imported on first use only: Focus client, JWT, password hashing, migrations
+LAZY_MODULES = ["requests", "urllib3", "jose", "bcrypt", "alembic"]
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def run(args, env):
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def slowest_imports(env, top=15):
+    """(ms acumulado, módulo) dos imports mais lentos, do stderr do -X importtime."""
+    rows = []
+    for line in run(["-X", "importtime", "-c", "import main"], env).stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]) / 1000, parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET_MS
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    import json
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "startup.db")
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{db_path}",
+            "DOCUMENTS_DIR": os.path.join(tmp, "documentos"),
+        }
+        # Warm the OS file cache and write __pycache__, so every timed round
+        # loads bytecode like a deployed app instead of compiling the sources
+        run(["-c", "import main"], env)
+        timings, loaded = [], set()
+        for _ in range(rounds):
+            result = run(["-c", PROBE], env)
+            if result.returncode != 0:
+                print(result.stderr)
+                sys.exit(1)
+            probe = json.loads(result.stdout.strip().splitlines()[-1])
+            timings.append(probe["ms"])
+            loaded.update(probe["loaded"])
+        touched_db = os.path.exists(db_path)
+
+        best = min(timings)
+        print(f"import main: melhor {best:.0f}ms, pior {max(timings):.0f}ms em {rounds} rodadas (orçamento {budget:.0f}ms)")
+        problems = []
+        if best > budget:
+            problems.append(f"import acima do orçamento: {best:.0f}ms > {budget:.0f}ms")
+        if loaded:
+            problems.append(f"carregados no import: {', '.join(sorted(loaded))}")
+        if touched_db:
+            problems.append("o import abriu o banco (create_all ou query no import?)")
+        if problems:
+            for problem in problems:
+                print(f"❌ {problem}")
+            print("módulos mais lentos (acumulado):")
+            for ms, name in slowest_imports(env):
+                print(f"  {ms:8.1f}ms {name}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
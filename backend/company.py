@@ -0,0 +1,105 @@
+"""
+Cache do CompanySettings de cada filial, por processo.
+
+Toda operação fiscal precisa do emitente (CNPJ só com dígitos, UF, regime e
+os tributos padrão do regime). Em vez de consultar company_settings a cada
+nota, cada processo guarda o perfil já normalizado de cada filial (tenant_id)
+e só confere, no máximo a cada COMPANY_SETTINGS_CHECK_SECONDS, o número de
+versão dela em settings_version. POST /settings/company incrementa a versão
+na mesma transação do UPDATE, e os outros workers do uvicorn recarregam na
+próxima conferência.
+"""
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+
+import models
+import payload_builder
+import schemas
+from config import settings
+from database import SessionLocal
+
+version_table = models.SettingsVersion.__table__
+
+
+class CompanyProfile(NamedTuple):
+    settings: Optional[schemas.CompanySettings]  # None enquanto a empresa não foi cadastrada
+    emitter: payload_builder.Emitter
+    version: int
+
+
+def version_key(tenant_id: int) -> str:
+    return f"company_settings:{tenant_id}"
+
+
+def read_version(db, tenant_id: int) -> int:
+    key = version_key(tenant_id)
+    return db.execute(select(version_table.c.version).where(version_table.c.name == key)).scalar() or 0
+
+
+def bump_version(db, tenant_id: int):
+    """Incrementa a versão da filial; vai para o banco no commit de quem chamou."""
+    key = version_key(tenant_id)
+    result = db.execute(
+        update(version_table).where(version_table.c.name == key).values(version=version_table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        db.execute(insert(version_table).values(name=key, version=1))
+
+
+def load_profile(db, tenant_id: int, version: int) -> CompanyProfile:
+    company = db.query(models.CompanySettings).filter(models.CompanySettings.tenant_id == tenant_id).first()
+    # FOCUS_NFE_CNPJ predates the branches: only the default one may fall back to it
+    fallback_cnpj = settings.FOCUS_NFE_CNPJ if tenant_id == models.DEFAULT_TENANT_ID else None
+    cnpj_emitente = company.cnpj if company else fallback_cnpj
+    uf_emitente = company.uf if company and company.uf else "SC"  # Fallback to SC if missing
+    regime = company.regime_tributario if company else 1
+    return CompanyProfile(
+        schemas.CompanySettings.model_validate(company) if company else None,
+        payload_builder.compile_emitter(cnpj_emitente or "", uf_emitente, regime),
+        version,
+    )
+
+
+class CompanySettingsCache:
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self._entries: Dict[int, Tuple[CompanyProfile, float]] = {}  # tenant_id -> (profile, next check)
+        self._lock = threading.Lock()
+
+    def cached(self, tenant_id: int) -> Optional[CompanyProfile]:
+        """Perfil em memória, ou None quando é hora de conferir a versão no banco."""
+        entry = self._entries.get(tenant_id)
+        if entry is not None and time.monotonic() < entry[1]:
+            return entry[0]
+        return None
+
+    def get(self, tenant_id: int, db=None) -> CompanyProfile:
+        """Perfil da filial; `db` é opcional (sem ele abre uma sessão só se precisar conferir)."""
+        entry = self.cached(tenant_id)
+        if entry is not None:
+            return entry
+        if db is None:
+            with SessionLocal() as db:
+                return self.refresh(db, tenant_id)
+        return self.refresh(db, tenant_id)
+
+    def refresh(self, db, tenant_id: int) -> CompanyProfile:
+        """Confere a versão da filial no banco e recarrega o perfil se mudou (para db.run_sync)."""
+        current = self._entries.get(tenant_id)
+        entry = current[0] if current else None
+        version = read_version(db, tenant_id)
+        if entry is None or entry.version != version:
+            entry = load_profile(db, tenant_id, version)
+        with self._lock:
+            self._entries[tenant_id] = (entry, time.monotonic() + self.check_interval)
+        return entry
+
+    def invalidate(self, tenant_id: int):
+        with self._lock:
+            self._entries.pop(tenant_id, None)
+
+
+company_cache = CompanySettingsCache(settings.COMPANY_SETTINGS_CHECK_SECONDS)
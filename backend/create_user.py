@@ -6,7 +6,7 @@ import auth
 # Ensure tables exist
 models.Base.metadata.create_all(bind=engine)
 
-def create_user(username, password, full_name=None):
+def create_user(username, password, full_name=None, tenant_id=models.DEFAULT_TENANT_ID):
     db = SessionLocal()
     try:
         # Check if user exists
@@ -19,7 +19,8 @@ def create_user(username, password, full_name=None):
         user = models.User(
             username=username,
             hashed_password=hashed_password,
-            full_name=full_name
+            full_name=full_name,
+            tenant_id=tenant_id,
         )
         db.add(user)
         db.commit()
@@ -31,11 +32,12 @@ def create_user(username, password, full_name=None):
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python create_user.py <username> <password> [full_name]")
+        print("Usage: python create_user.py <username> <password> [full_name] [tenant_id]")
         sys.exit(1)
     
     username = sys.argv[1]
     password = sys.argv[2]
     full_name = sys.argv[3] if len(sys.argv) > 3 else None
+    tenant_id = int(sys.argv[4]) if len(sys.argv) > 4 else models.DEFAULT_TENANT_ID
     
-    create_user(username, password, full_name)
+    create_user(username, password, full_name, tenant_id)
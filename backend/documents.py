@@ -0,0 +1,226 @@
+"""
+XML e DANFE das notas autorizadas, baixados da Focus NFe e guardados aqui.
+
+Quando uma nota é autorizada (retorno da emissão ou webhook) entra um
+DocumentJob por arquivo na fila document_queue; os workers daqui baixam o
+arquivo em streaming para DOCUMENTS_DIR, endereçado pelo SHA-256 do conteúdo
+(DOCUMENTS_DIR/ab/abcdef...), e registram em invoice_documents. Assim a tela
+financeira e a contabilidade leem do disco local, com ETag e Range, sem
+depender da Focus estar no ar, e o mesmo arquivo nunca é gravado duas vezes.
+
+Nada é apagado daqui: o XML precisa ser guardado por 5 anos.
+
+Usage: python documents.py
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import delete, select
+
+import logs
+import models
+from config import settings
+from database import SessionLocal
+from export import EXPORT_CHUNK_ROWS, date_range
+from fiscal import fiscal_client, focus_file_url
+from workers import QueueWorkers, claim_next, retry_later
+
+log = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Download lease: a worker that dies mid-transfer gives the job back after this
+LEASE_SECONDS = 300
+# Refs per IN (...) lookup, below SQLite's bound parameter limit
+LOOKUP_CHUNK = 500
+
+# kind -> (field in the Focus response, content type, file name suffix)
+KINDS = {
+    "xml": ("caminho_xml_nota_fiscal", "application/xml", "-nfe.xml"),
+    "pdf": ("caminho_danfe", "application/pdf", "-danfe.pdf"),
+}
+
+queue_table = models.DocumentJob.__table__
+documents_table = models.InvoiceDocument.__table__
+invoices_table = models.Invoice.__table__
+
+
+def path_for(sha256: str) -> Path:
+    return Path(settings.DOCUMENTS_DIR) / sha256[:2] / sha256
+
+
+def enqueue(db, ref: str, result: dict) -> bool:
+    """
+    Enfileira o download dos caminho_* presentes em `result` que ainda não
+    estão guardados nem na fila. Vai para o banco no commit de quem chamou;
+    retorna True se algo entrou na fila.
+    """
+    return enqueue_many(db, {ref: result})
+
+
+def enqueue_many(db, results: Dict[str, dict]) -> bool:
+    """enqueue() para várias notas ({ref: result}), com um IN por bloco e um INSERT em lote."""
+    # Only paths on the Focus host: the rest never reaches the download
+    wanted = {
+        (ref, kind): result.get(field)
+        for ref, result in results.items()
+        for kind, (field, _, _) in KINDS.items() if focus_file_url(result.get(field))
+    }
+    refs = list({ref for ref, _ in wanted})
+    for start in range(0, len(refs), LOOKUP_CHUNK):
+        chunk = refs[start:start + LOOKUP_CHUNK]
+        for table in (documents_table, queue_table):
+            for known in db.execute(select(table.c.ref, table.c.kind).where(table.c.ref.in_(chunk))):
+                wanted.pop(tuple(known), None)
+    if not wanted:
+        return False
+    now = datetime.now()
+    db.execute(
+        queue_table.insert(),
+        [{"ref": ref, "kind": kind, "path": path, "attempts": 0, "next_attempt_at": now} for (ref, kind), path in wanted.items()],
+    )
+    return True
+
+
+def claim_job(db):
+    """Reserva o próximo download vencido. Retorna (id, ref, kind, path, attempts) ou None."""
+    return claim_next(
+        db, queue_table, LEASE_SECONDS,
+        queue_table.c.id, queue_table.c.ref, queue_table.c.kind, queue_table.c.path, queue_table.c.attempts,
+    )
+
+
+def _store(response) -> tuple:
+    """Grava o corpo num arquivo temporário calculando o hash e o move para o lugar. Retorna (sha256, size)."""
+    root = Path(settings.DOCUMENTS_DIR)
+    root.mkdir(parents=True, exist_ok=True)
+    digest, size = hashlib.sha256(), 0
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".download-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        sha256 = digest.hexdigest()
+        target = path_for(sha256)
+        target.parent.mkdir(exist_ok=True)
+        # Same hash, same bytes: an existing file is kept as is
+        if target.exists():
+            os.unlink(tmp)
+        else:
+            os.replace(tmp, target)
+        return sha256, size
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _retry(db, job_id: int, attempts: int, error: str):
+    # Never given up on (the XML must be kept), only spaced out
+    delay = min(settings.DOCUMENT_BACKOFF * 2 ** (attempts - 1), settings.DOCUMENT_MAX_BACKOFF)
+    retry_later(db, queue_table, job_id, delay, error)
+
+
+def process_job(db, job_id: int, ref: str, kind: str, path: str, attempts: int):
+    import requests
+
+    url = focus_file_url(path)
+    if url is None:
+        # Queued before paths were checked: never sent with the Focus credentials
+        log.warning("❌ Download de %s (%s) descartado: caminho fora da Focus %r", ref, kind, path)
+        db.execute(delete(queue_table).where(queue_table.c.id == job_id))
+        db.commit()
+        return
+
+    try:
+        with fiscal_client.download(url) as response:
+            if response.status_code != 200:
+                return _retry(db, job_id, attempts, f"HTTP {response.status_code}")
+            sha256, size = _store(response)
+    except (requests.RequestException, OSError) as e:
+        return _retry(db, job_id, attempts, str(e))
+
+    db.merge(models.InvoiceDocument(ref=ref, kind=kind, sha256=sha256, size=size, stored_at=datetime.now()))
+    db.execute(delete(queue_table).where(queue_table.c.id == job_id))
+    db.commit()
+
+
+def get_document(db, ref: str, kind: str) -> Optional[models.InvoiceDocument]:
+    return db.get(models.InvoiceDocument, (ref, kind))
+
+
+class _ZipSink:
+    """Destino do ZipFile sem seek: guarda o que foi escrito até a próxima leitura."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_documents(
+    tenant_id: int, kinds, date_from: Optional[date] = None, date_to: Optional[date] = None
+) -> Iterator[bytes]:
+    """
+    ZIP com os arquivos guardados das notas da filial no período, gerado em
+    streaming: cada arquivo é lido do disco e enviado antes do próximo. Notas
+    cujos arquivos ainda não foram baixados ficam de fora.
+    """
+    query = (
+        select(invoices_table.c.ref, invoices_table.c.access_key, documents_table.c.kind, documents_table.c.sha256)
+        .join(documents_table, documents_table.c.ref == invoices_table.c.ref)
+        .where(
+            invoices_table.c.tenant_id == tenant_id,
+            documents_table.c.kind.in_(kinds),
+            *date_range(invoices_table.c.issued_at, date_from, date_to),
+        )
+        .order_by(invoices_table.c.issued_at, invoices_table.c.ref, documents_table.c.kind)
+        .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    )
+    sink = _ZipSink()
+    with SessionLocal() as db, zipfile.ZipFile(sink, "w") as archive:
+        for ref, access_key, kind, sha256 in db.execute(query):
+            _, _, suffix = KINDS[kind]
+            name = f"{kind}/{access_key or ref}{suffix}"
+            # PDFs are already compressed; deflating them only costs CPU
+            method = zipfile.ZIP_DEFLATED if kind == "xml" else zipfile.ZIP_STORED
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = method
+            with open(path_for(sha256), "rb") as source, archive.open(info, "w") as target:
+                while chunk := source.read(DOWNLOAD_CHUNK_BYTES):
+                    target.write(chunk)
+                    if data := sink.drain():
+                        yield data
+    # Central directory, written on close
+    if data := sink.drain():
+        yield data
+
+
+document_workers = QueueWorkers("documents", settings.DOCUMENT_WORKERS, claim_job, process_job)
+
+
+if __name__ == "__main__":
+    logs.configure()
+    workers = QueueWorkers("documents", max(settings.DOCUMENT_WORKERS, 1), claim_job, process_job)
+    log.info("📄 %s workers baixando XML/DANFE para %s", workers.workers, settings.DOCUMENTS_DIR)
+    workers.run_forever()
@@ -0,0 +1,148 @@
+"""
+Fila de emissão de NF-e.
+
+As rotas gravam a nota (Invoice com status "processando") e um
+EmissionJob na mesma transação e respondem na hora com o `ref`. Os workers
+daqui retiram os jobs da tabela emission_queue, enviam para a Focus NFe e
+gravam o retorno. A autorização final normalmente chega pelo /webhook/focus;
+enquanto a Focus responder "processando", o job continua na fila e volta a
+cada EMISSION_POLL_SECONDS para consultar GET /nfe/{ref}, até a nota sair
+desse estado (por esta consulta ou por um webhook). Assim um callback
+perdido não deixa a nota presa em "processando".
+
+Como a fila mora no banco, ela sobrevive a restart e pode ser consumida por
+vários processos. Para rodar só os workers, fora do uvicorn:
+
+Usage: python emission.py
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+
+import documents
+import logs
+import models
+from config import settings
+from fiscal import fiscal_client, focus_file_url
+from workers import QueueWorkers, claim_next, retry_later
+
+log = logging.getLogger(__name__)
+
+queue_table = models.EmissionJob.__table__
+
+# Accepted by Focus, SEFAZ has not decided yet
+IN_FLIGHT = ("processando", "processando_autorizacao")
+
+
+def enqueue(db, ref: str, payload: dict):
+    """Adiciona o job à sessão; vai para o banco no commit de quem chamou."""
+    db.add(models.EmissionJob(ref=ref, payload=json.dumps(payload), attempts=0, next_attempt_at=datetime.now()))
+
+
+def enqueue_many(db, jobs):
+    """Enfileira [(ref, payload), ...] com um único INSERT em lote (executemany)."""
+    now = datetime.now()
+    db.execute(
+        queue_table.insert(),
+        [{"ref": ref, "payload": json.dumps(payload), "attempts": 0, "next_attempt_at": now} for ref, payload in jobs],
+    )
+
+
+def claim_job(db):
+    """Reserva o próximo job vencido. Retorna (ref, payload, attempts) ou None."""
+    return claim_next(
+        db, queue_table, settings.EMISSION_LEASE_SECONDS,
+        queue_table.c.ref, queue_table.c.payload, queue_table.c.attempts,
+    )
+
+
+def _finish(db, ref: str, result: dict):
+    # Only the queue's own "processando" is overwritten: a webhook may already
+    # have delivered the final status while we were waiting for the response
+    status = result.get("status") or "processando"
+
+    invoice = db.get(models.Invoice, ref)
+    if invoice:
+        if invoice.status in IN_FLIGHT:
+            invoice.status = status
+        invoice.status_sefaz = result.get("status_sefaz") or invoice.status_sefaz
+        invoice.mensagem_sefaz = result.get("mensagem_sefaz") or result.get("mensagem") or invoice.mensagem_sefaz
+        invoice.number = result.get("numero") or invoice.number
+        invoice.series = result.get("serie") or invoice.series
+        invoice.access_key = result.get("chave_nfe") or invoice.access_key
+        invoice.pdf_url = focus_file_url(result.get("caminho_danfe")) or invoice.pdf_url
+        invoice.xml_url = focus_file_url(result.get("caminho_xml_nota_fiscal")) or invoice.xml_url
+
+    queued = status == "autorizado" and documents.enqueue(db, ref, result)
+    if status in IN_FLIGHT:
+        # Kept as the reconciliation poll: attempts=1 makes the next claim ask
+        # GET /nfe/{ref} instead of posting again
+        db.execute(
+            update(queue_table)
+            .where(queue_table.c.ref == ref)
+            .values(attempts=1, last_error=None,
+                    next_attempt_at=datetime.now() + timedelta(seconds=settings.EMISSION_POLL_SECONDS))
+        )
+    else:
+        db.execute(delete(queue_table).where(queue_table.c.ref == ref))
+    db.commit()
+    if queued:
+        documents.document_workers.notify()
+
+
+def _retry_or_fail(db, ref: str, attempts: int, error: str):
+    if attempts >= settings.EMISSION_MAX_ATTEMPTS:
+        log.warning("❌ Emissão %s desistida após %s tentativas: %s", ref, attempts, error)
+        _finish(db, ref, {"status": "erro_envio", "mensagem": error[:500]})
+        return
+    retry_later(db, queue_table, ref, settings.EMISSION_BACKOFF * 2 ** (attempts - 1), error)
+
+
+def process_job(db, ref: str, payload: str, attempts: int):
+    import requests
+
+    if attempts > 1:
+        invoice = db.get(models.Invoice, ref)
+        if invoice is not None and invoice.status not in IN_FLIGHT:
+            # A webhook already brought the outcome: nothing left to ask Focus
+            db.execute(delete(queue_table).where(queue_table.c.ref == ref))
+            db.commit()
+            return
+
+    try:
+        if attempts > 1:
+            # The previous attempt may have reached Focus before failing on our
+            # side; never POST the same ref twice
+            existing = fiscal_client.request("GET", f"/nfe/{ref}")
+            if existing.status_code == 200:
+                return _finish(db, ref, existing.json())
+
+        response = fiscal_client.request("POST", "/nfe", params={"ref": ref}, data=payload,
+                                         headers={"Content-Type": "application/json"})
+    except requests.RequestException as e:
+        return _retry_or_fail(db, ref, attempts, str(e))
+
+    # Transient (the session already retried these a few times) or bad token
+    if response.status_code in (401, 403, 429) or response.status_code >= 500:
+        return _retry_or_fail(db, ref, attempts, f"HTTP {response.status_code}: {response.text}")
+
+    try:
+        result = response.json()
+    except ValueError:
+        result = {"mensagem": response.text}
+    if response.status_code >= 400:
+        # Rejected by validation: retrying the same payload will not help
+        result.setdefault("status", "erro_autorizacao")
+    _finish(db, ref, result)
+
+
+emission_workers = QueueWorkers("emission", settings.EMISSION_WORKERS, claim_job, process_job)
+
+
+if __name__ == "__main__":
+    logs.configure()
+    workers = QueueWorkers("emission", max(settings.EMISSION_WORKERS, 1), claim_job, process_job)
+    log.info("📮 %s workers de emissão consumindo a fila", workers.workers)
+    workers.run_forever()
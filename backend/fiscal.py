@@ -1,171 +1,144 @@
-import requests
-import json
-from datetime import datetime
+import logging
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
 from config import settings
-from database import SessionLocal
-from models import CompanySettings
+from company import company_cache
+from models import DEFAULT_TENANT_ID
+import metrics
+import payload_builder
+
+log = logging.getLogger(__name__)
+
+# Focus NFe answers these when overloaded or during SEFAZ instability.
+# Retrying POST/DELETE is safe because every emission carries its own ref,
+# and Focus never creates two notes for the same ref.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# requests (and urllib3) are imported on the first call to Focus, not at
+# startup: most processes serve many requests before emitting a note
+
+# caminho_* paths are relative to the Focus host, not to /v2. Taken from
+# FOCUS_NFE_URL so homologação and the bench stub get links to themselves
+_focus_base = urlsplit(settings.FOCUS_NFE_URL)
+FOCUS_HOST = f"{_focus_base.scheme}://{_focus_base.netloc}"
+
+
+def is_focus_url(url: Optional[str]) -> bool:
+    """True se a URL aponta para o host da Focus (mesmo esquema, host e porta)."""
+    if not url:
+        return False
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}" == FOCUS_HOST
+
+
+def focus_file_url(path: Optional[str]) -> Optional[str]:
+    """
+    URL de um caminho_* da Focus, ou None se não for um caminho no host dela.
+
+    Os caminhos também chegam pelo webhook, que não é autenticado: uma URL
+    absoluta, "//host" ou "@host" levaria o download (com o token da Focus na
+    sessão) ou o redirect do DANFE para outro servidor.
+    """
+    if not path or not path.startswith("/") or path.startswith("//"):
+        return None
+    url = f"{FOCUS_HOST}{path}"
+    return url if is_focus_url(url) else None
 
 class FocusNFeClient:
     def __init__(self):
         self.token = settings.FOCUS_NFE_TOKEN
         # SEMPRE usar URL de produção - o ambiente é definido no painel da Focus
         self.base_url = settings.FOCUS_NFE_URL
-
-    def emit_nfe(self, sale_data: dict):
-        # Fetch company settings from DB
-        db = SessionLocal()
-        company = db.query(CompanySettings).first()
-        db.close()
-
-        cnpj_emitente = company.cnpj if company else settings.FOCUS_NFE_CNPJ
-        # Strip non-numeric characters
-        cnpj_emitente = "".join(filter(str.isdigit, cnpj_emitente)) if cnpj_emitente else ""
-
-        payload = {
-            "natureza_operacao": "Venda de Mercadoria",
-            "cnpj_emitente": cnpj_emitente,
-            "data_emissao": sale_data.get("date"),
-            "ref": sale_data.get("id"),
-            "itens": [
-                {
-                    "codigo_produto": item["id"],
-                    "nome_produto": item["name"],
-                    "cfop": "5102", # Default intra-state sale
-                    "quantidade": item["quantity"],
-                    "valor_unitario": item["unitPrice"],
-                    "valor_total": item["subtotal"]
-                } for item in sale_data.get("items", [])
-            ],
-            # Placeholder for client data (required for NFe)
-            "destinatario": {
-                "nome": "Consumidor Final",
-                "cpf": "000.000.000-00",
-                "indicador_inscricao_estadual": "9"
-            }
-        }
-
-        url = f"{self.base_url}/nfe"
-        
-        # Debug: Show masked token and URL
-        masked_token = f"{self.token[:4]}...{self.token[-4:]}" if self.token and len(self.token) > 8 else "INVALIDO"
-        print(f"🔐 Token usado: {masked_token}")
-        print(f"📡 URL: {url}")
-        print(f"🏢 CNPJ Emitente: {cnpj_emitente}")
-
-        # Check if token is configured
-        if "COLE_SEU_TOKEN_AQUI" in str(self.token) or not self.token:
-            print("⚠️ Token não configurado. Retornando Mock.")
-            return {
-                "status": "erro_configuracao",
-                "message": "Token da API Fiscal não configurado no .env"
-            }
-        
-        try:
-            # Basic Auth with Token as username
-            response = requests.post(url, json=payload, auth=(self.token, ""))
-            
-            # Handle specific auth errors
-            if response.status_code in [401, 403]:
-                print(f"❌ Erro de Autenticação ({response.status_code}): {response.text}")
-                raise Exception("Acesso Negado. Verifique se o TOKEN está correto e se é do ambiente de HOMOLOGAÇÃO.")
-
-            response.raise_for_status()
-            
-            data = response.json()
-            print(f"✅ Resposta da API: {data}")
-            return data
-            
-        except requests.exceptions.HTTPError as e:
-            error_content = e.response.text
-            print(f"❌ Erro na API Fiscal: {error_content}")
-            raise Exception(f"Erro na API Fiscal: {error_content}")
-        except Exception as e:
-            print(f"❌ Erro inesperado: {str(e)}")
-            raise e
-
-    def emit_manual_nfe(self, data: dict):
-        # Fetch company settings from DB
-        db = SessionLocal()
-        company = db.query(CompanySettings).first()
-        db.close()
-
-        cnpj_emitente = company.cnpj if company else settings.FOCUS_NFE_CNPJ
-        cnpj_emitente = "".join(filter(str.isdigit, cnpj_emitente)) if cnpj_emitente else ""
-
-        # Prepare payload
-        recipient = data["recipient"]
-        item = data["item"]
-        
-        # Determine if CPF or CNPJ
-        cpf_cnpj_value = "".join(filter(str.isdigit, recipient["cpf_cnpj"]))
-        destinatario_data = {
-            "nome": recipient["name"],
-            "logradouro": recipient["logradouro"],
-            "numero": recipient["numero"],
-            "bairro": recipient["bairro"],
-            "municipio": recipient["municipio"],
-            "uf": recipient["uf"],
-            "cep": recipient["cep"],
-            "indicador_inscricao_estadual": "9"
-        }
-
-        if len(cpf_cnpj_value) > 11:
-            destinatario_data["cnpj"] = cpf_cnpj_value
-        else:
-            destinatario_data["cpf"] = cpf_cnpj_value
-
-        payload = {
-            "natureza_operacao": "Venda de Mercadoria (Avulsa)",
-            "cnpj_emitente": cnpj_emitente,
-            "data_emissao": datetime.now().isoformat(),
-            "tipo_documento": 1, # 1 - Saída
-            "finalidade_emissao": 1, # 1 - Normal
-            "modalidade_frete": 9, # 9 - Sem frete
-            "ref": f"manual-{item['name'][:5]}", 
-            "itens": [
-                {
-                    "numero_item": 1,
-                    "codigo_produto": "MANUAL-001",
-                    "descricao": item["name"],
-                    "codigo_ncm": item["ncm"],
-                    "cfop": item["cfop"],
-                    "unidade_comercial": "UN",
-                    "quantidade_comercial": item["quantity"],
-                    "valor_unitario_comercial": item["price"],
-                    "unidade_tributavel": "UN",
-                    "quantidade_tributavel": item["quantity"],
-                    "valor_unitario_tributavel": item["price"],
-                    "valor_bruto": item["price"] * item["quantity"],
-                    "valor_total": item["price"] * item["quantity"]
-                }
-            ],
-            "destinatario": destinatario_data
-        }
-
-        url = f"{self.base_url}/nfe"
-        
-        print(f"📡 Enviando NFe Manual para: {url}")
-        print(f"📦 Payload: {json.dumps(payload, indent=2)}")
-
+        self.timeout = (settings.FOCUS_NFE_CONNECT_TIMEOUT, settings.FOCUS_NFE_READ_TIMEOUT)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # One keep-alive pool for all Focus traffic: no TCP/TLS handshake per note
+        retry = Retry(
+            total=settings.FOCUS_NFE_RETRIES,
+            backoff_factor=settings.FOCUS_NFE_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "POST", "DELETE"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.FOCUS_NFE_POOL_SIZE,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.auth = (self.token or "", "")
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request(self, method: str, path: str, **kwargs):
+        """Chamada à API da Focus pelo pool compartilhado. `path` é relativo a /v2."""
+        operation = path.strip("/").split("/", 1)[0] or "raiz"
+        return self._send(operation, method, f"{self.base_url}{path}", **kwargs)
+
+    def download(self, url: str):
+        """GET em streaming de um arquivo da Focus (XML/DANFE); use com `with`."""
+        return self._send("arquivo", "GET", url, stream=True)
+
+    def _send(self, operation: str, method: str, url: str, **kwargs):
+        import requests
+
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
         try:
-            response = requests.post(url, json=payload, auth=(self.token, ""))
-            
-            if response.status_code in [401, 403]:
-                 raise Exception(f"Erro de Autenticação: {response.text}")
-
-            response.raise_for_status()
-            return response.json()
-            
-        except requests.exceptions.HTTPError as e:
-            error_content = e.response.text
-            print(f"❌ Erro na API Fiscal: {error_content}")
-            # Return the error as JSON so frontend can see it
-            try:
-                return json.loads(error_content)
-            except:
-                return {"error": error_content}
-        except Exception as e:
-            print(f"❌ Erro inesperado: {str(e)}")
-            raise e
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            metrics.observe_focus(operation, method, "erro", time.perf_counter() - start)
+            raise
+        metrics.observe_focus(operation, method, response.status_code, time.perf_counter() - start)
+        return response
+
+    def is_configured(self) -> bool:
+        return bool(self.token) and "COLE_SEU_TOKEN_AQUI" not in str(self.token)
+
+    def emitter(self, tenant_id: int = DEFAULT_TENANT_ID) -> payload_builder.Emitter:
+        """Emitente compilado da filial, do cache por filial do company.py."""
+        return company_cache.get(tenant_id).emitter
+
+    def build_nfe_payload(self, sale_data: dict, catalog: dict = None, emitter: payload_builder.Emitter = None):
+        """
+        (payload, valor total) da NF-e de uma venda do PDV. `catalog` mapeia
+        id do produto -> linha com ncm/cfop/unit; sem ele, usa os padrões.
+        """
+        emitter = emitter or self.emitter()
+        catalog = catalog or {}
+        lines = []
+        for item in sale_data.get("items", []):
+            product = catalog.get(int(item["id"])) if str(item["id"]).isdigit() else None
+            lines.append(payload_builder.Line(
+                code=str(item["id"]),
+                description=item["name"],
+                ncm=(product.ncm if product else None) or payload_builder.DEFAULT_NCM,
+                cfop=(product.cfop if product else None) or payload_builder.DEFAULT_CFOP, # Default intra-state sale
+                quantity=item["quantity"],
+                unit_price=item["unitPrice"],
+                unit=(product.unit if product else None) or payload_builder.DEFAULT_UNIT,
+            ))
+        return payload_builder.build_payload(
+            emitter, lines, payload_builder.consumer_recipient(emitter), data_emissao=sale_data.get("date")
+        )
 
 fiscal_client = FocusNFeClient()
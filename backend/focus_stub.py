@@ -0,0 +1,195 @@
+"""
+Stub local da API da Focus NFe para testes e benchmarks, sem tocar na SEFAZ.
+
+Responde POST /v2/nfe, GET /v2/nfe/{ref} e DELETE /v2/nfe/{ref} no formato
+da Focus, e GET /arquivos/{ref}.xml|.pdf com um XML/DANFE de mentira. Pode
+simular latência e falhas (503) para exercitar timeouts e retry do
+FocusNFeClient.
+
+Com --webhook-url ele se comporta como a Focus de verdade: o POST responde
+"processando_autorizacao" e a autorização chega depois por callback, que
+pode ser repetido (--webhook-copies) como a Focus faz.
+
+Usage: python focus_stub.py [--port 8900] [--latency 0.2] [--fail-first 2]
+                            [--webhook-url http://127.0.0.1:8000/webhook/focus]
+Depois: FOCUS_NFE_URL=http://127.0.0.1:8900/v2 uvicorn main:app
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FocusStubState:
+    def __init__(self, latency: float = 0.0, fail_first: int = 0, webhook_url: str = None,
+                 webhook_delay: float = 0.05, webhook_copies: int = 1):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.webhook_url = webhook_url
+        self.webhook_delay = webhook_delay
+        self.webhook_copies = webhook_copies
+        self.webhooks_sent = 0
+        self.webhook_errors = 0
+        self.requests = []
+        self.notes = {}
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._next_number = 1
+
+    def record(self, method, path, client_address):
+        with self._lock:
+            self.requests.append((method, path))
+            self.connections.add(client_address)
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return True
+            return False
+
+    def emit(self, ref):
+        with self._lock:
+            if ref not in self.notes:
+                number = self._next_number
+                self._next_number += 1
+                self.notes[ref] = {
+                    "ref": ref,
+                    "status": "processando_autorizacao" if self.webhook_url else "autorizado",
+                    "status_sefaz": "100",
+                    "mensagem_sefaz": "Autorizado o uso da NF-e",
+                    "numero": str(number),
+                    "serie": "1",
+                    "chave_nfe": f"NFe{number:044d}",
+                    "caminho_xml_nota_fiscal": f"/arquivos/{ref}.xml",
+                    "caminho_danfe": f"/arquivos/{ref}.pdf",
+                }
+                if self.webhook_url:
+                    threading.Timer(self.webhook_delay, self._authorize, (ref,)).start()
+            return dict(self.notes[ref])
+
+    def _authorize(self, ref):
+        with self._lock:
+            note = self.notes[ref]
+            note["status"] = "autorizado"
+            note["protocolo"] = f"1{note['chave_nfe'][-14:]}"
+            body = json.dumps(note).encode("utf-8")
+        for _ in range(self.webhook_copies):
+            request = urllib.request.Request(
+                self.webhook_url, data=body, headers={"Content-Type": "application/json"}, method="POST"
+            )
+            try:
+                urllib.request.urlopen(request, timeout=10).close()
+                sent = True
+            except OSError:
+                sent = False
+            with self._lock:
+                if sent:
+                    self.webhooks_sent += 1
+                else:
+                    self.webhook_errors += 1
+
+
+class FocusStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    state: FocusStubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, name):
+        ref, _, ext = name.rpartition(".")
+        note = self.state.notes.get(ref)
+        if note is None or ext not in ("xml", "pdf"):
+            return self._send(404, {"codigo": "nao_encontrado"})
+        if ext == "xml":
+            data = f'<?xml version="1.0" encoding="UTF-8"?><nfeProc><chNFe>{note["chave_nfe"]}</chNFe></nfeProc>'.encode()
+        else:
+            data = b"%PDF-1.4\n% DANFE " + note["chave_nfe"].encode() + b"\n%%EOF\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml" if ext == "xml" else "application/pdf")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        body = self._read_body()
+        if self.state.record(method, self.path, self.client_address):
+            return self._send(503, {"codigo": "servico_indisponivel", "mensagem": "Stub: falha simulada"})
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        parts = url.path.rstrip("/").split("/")  # ['', 'v2', 'nfe', ref?]
+        if method == "GET" and parts[:2] == ["", "arquivos"] and len(parts) == 3:
+            return self._send_file(parts[2])
+        if parts[:3] != ["", "v2", "nfe"]:
+            return self._send(404, {"codigo": "nao_encontrado"})
+
+        if method == "POST":
+            ref = parse_qs(url.query).get("ref", [body.get("ref")])[0] or f"stub-{len(self.state.notes) + 1}"
+            return self._send(201, self.state.emit(ref))
+
+        ref = parts[3] if len(parts) > 3 else None
+        note = self.state.notes.get(ref)
+        if note is None:
+            return self._send(404, {"codigo": "nao_encontrado", "mensagem": "Nota fiscal não encontrada"})
+        if method == "DELETE":
+            note["status"] = "cancelado"
+        return self._send(200, note)
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+def start_stub(port: int = 0, latency: float = 0.0, fail_first: int = 0, **webhook):
+    """
+    Sobe o stub numa thread. Retorna (server, state); a URL base é
+    http://127.0.0.1:<port>/v2. `webhook` vai para FocusStubState
+    (webhook_url, webhook_delay, webhook_copies).
+    """
+    state = FocusStubState(latency=latency, fail_first=fail_first, **webhook)
+    handler = type("Handler", (FocusStubHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub local da Focus NFe")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por requisição")
+    parser.add_argument("--fail-first", type=int, default=0, help="responde 503 nas N primeiras requisições")
+    parser.add_argument("--webhook-url", help="URL do /webhook/focus que recebe as autorizações")
+    parser.add_argument("--webhook-delay", type=float, default=0.05, help="segundos até o callback")
+    parser.add_argument("--webhook-copies", type=int, default=1, help="quantas vezes cada callback é enviado")
+    args = parser.parse_args()
+
+    server, _ = start_stub(
+        args.port, args.latency, args.fail_first,
+        webhook_url=args.webhook_url, webhook_delay=args.webhook_delay, webhook_copies=args.webhook_copies,
+    )
+    print(f"Focus NFe stub em http://127.0.0.1:{server.server_port}/v2")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
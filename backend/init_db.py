@@ -0,0 +1,52 @@
+"""
+Criação e atualização do schema, fora do import do app.
+
+O main.py não mexe no banco ao ser importado: com DB_INIT_ON_STARTUP=1
+(padrão) o lifespan chama init_db() antes de subir os workers. Em deploys
+com vários processos ou serverless, use DB_INIT_ON_STARTUP=0 e rode este
+script uma vez por deploy: ele aplica as migrações do Alembic (que conferem
+o schema e não refazem nada) e cria as tabelas que faltam.
+
+Usage: python init_db.py
+"""
+import logging
+import os
+
+import logs
+import models
+from database import engine
+
+log = logging.getLogger(__name__)
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def create_tables():
+    models.Base.metadata.create_all(bind=engine)
+
+
+def upgrade():
+    # Imported here, not at module level: `import main` must not load Alembic
+    # (check_startup.py); the app only pays for it when the lifespan runs
+    # init_db() (DB_INIT_ON_STARTUP=1)
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_INI)
+    # The app's logging is already set up; keep alembic.ini from replacing it
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, "head")
+
+
+def init_db():
+    # Migrations first: the current models (FTS triggers on products.tenant_id)
+    # assume columns an older database only gets from them. On an empty
+    # database they find nothing to change and create_all builds the rest
+    upgrade()
+    create_tables()
+
+
+if __name__ == "__main__":
+    logs.configure()
+    init_db()
+    log.info("🗄️ Schema atualizado em %s", engine.url.render_as_string(hide_password=True))
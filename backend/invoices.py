@@ -0,0 +1,102 @@
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+
+import models
+
+invoices_table = models.Invoice.__table__
+
+# Columns of the financial list; the Focus PDF/XML URLs stay in GET /invoices/{ref}
+SUMMARY_COLUMNS = [
+    invoices_table.c.ref,
+    invoices_table.c.status,
+    invoices_table.c.number,
+    invoices_table.c.series,
+    invoices_table.c.access_key,
+    invoices_table.c.issued_at,
+    invoices_table.c.recipient_name,
+    invoices_table.c.total_value,
+]
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(issued_at: datetime, ref: str) -> str:
+    return f"{issued_at.isoformat()}_{ref}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    # isoformat() has no "_", so the first one splits date and ref
+    try:
+        issued_at, ref = cursor.split("_", 1)
+        return datetime.fromisoformat(issued_at), ref
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def _filters(
+    tenant_id: int,
+    status: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    recipient: Optional[str] = None,
+) -> list:
+    conditions = [invoices_table.c.tenant_id == tenant_id]
+    if status:
+        conditions.append(invoices_table.c.status == status)
+    if date_from:
+        conditions.append(invoices_table.c.issued_at >= datetime.combine(date_from, time.min))
+    if date_to:
+        # date_to is inclusive: everything before the next midnight
+        conditions.append(invoices_table.c.issued_at < datetime.combine(date_to + timedelta(days=1), time.min))
+    if recipient:
+        escaped = recipient.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(invoices_table.c.recipient_name.ilike(f"%{escaped}%", escape="\\"))
+    return conditions
+
+
+def list_invoices(
+    db: Session,
+    limit: int,
+    cursor: Optional[str] = None,
+    **filters,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Página de notas de uma filial (filters["tenant_id"]), mais recentes
+    primeiro, por keyset em (issued_at, ref).
+
+    Sem filtro de status é um range scan em ix_invoices_tenant_issued_at_ref;
+    com status, em ix_invoices_tenant_status_issued_at_ref. O custo de cada
+    página não depende de quantas notas existem antes dela.
+    """
+    query = (
+        select(*SUMMARY_COLUMNS)
+        .where(*_filters(**filters))
+        .order_by(invoices_table.c.issued_at.desc(), invoices_table.c.ref.desc())
+    )
+    if cursor:
+        query = query.where(tuple_(invoices_table.c.issued_at, invoices_table.c.ref) < decode_cursor(cursor))
+
+    # One extra row tells whether there is a next page without a COUNT(*)
+    rows = db.execute(query.limit(limit + 1)).mappings().all()
+    page = rows[:limit]
+    last = page[-1] if len(rows) > limit else None
+    return page, encode_cursor(last["issued_at"], last["ref"]) if last else None
+
+
+def status_totals(db: Session, **filters) -> Dict[str, dict]:
+    """Quantidade e valor somado por status, com os mesmos filtros da listagem."""
+    rows = db.execute(
+        select(
+            invoices_table.c.status,
+            func.count().label("count"),
+            func.coalesce(func.sum(invoices_table.c.total_value), 0.0).label("total_value"),
+        )
+        .where(*_filters(**filters))
+        .group_by(invoices_table.c.status)
+    )
+    return {row.status or "desconhecido": {"count": row.count, "total_value": round(row.total_value, 2)} for row in rows}
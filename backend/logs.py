@@ -0,0 +1,111 @@
+"""
+Logging da aplicação.
+
+Cada módulo usa `log = logging.getLogger(__name__)`; configure() liga o root
+logger a uma QueueHandler, e uma thread (QueueListener) escreve no stderr,
+então quem loga nunca espera pelo terminal. O nível geral vem de LOG_LEVEL e
+os de cada módulo de LOG_LEVELS (ex.: "fiscal=DEBUG,webhooks=WARNING");
+LOG_FORMAT=json troca o texto por uma linha JSON por registro.
+
+Payloads completos só vão para o log em DEBUG, com dump(): a serialização só
+acontece se a mensagem passar do nível. CPF, CNPJ, o token da Focus e JWTs
+são mascarados na saída, seja qual for o nível.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+
+from config import settings
+
+CNPJ = re.compile(r"(?<!\d)\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}(?!\d)")
+CPF = re.compile(r"(?<!\d)\d{3}\.?\d{3}\.?\d{3}-?\d{2}(?!\d)")
+JWT = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+")
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+def _keep_last_two(match) -> str:
+    # "123.456.789-01" -> "***.***.***-01": enough to tell notes apart
+    text = match.group()
+    return re.sub(r"\d", "*", text[:-2]) + text[-2:]
+
+
+def mask(text: str) -> str:
+    text = CNPJ.sub(_keep_last_two, text)
+    text = CPF.sub(_keep_last_two, text)
+    text = JWT.sub("eyJ***", text)
+    token = settings.FOCUS_NFE_TOKEN
+    if token and len(token) > 4:
+        text = text.replace(token, f"{token[:4]}***")
+    return text
+
+
+class dump:
+    """JSON de `obj`, gerado só quando a mensagem é formatada: log.debug("payload %s", dump(payload))."""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj, ensure_ascii=False, default=str)
+
+
+class MaskingFormatter(logging.Formatter):
+    def format(self, record):
+        return mask(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return mask(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+def _module_levels(spec: str) -> dict:
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure():
+    """Liga o logging da aplicação; chamadas seguintes não fazem nada."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(MaskingFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in _module_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    # Whatever is still queued is written on exit
+    atexit.register(_listener.stop)
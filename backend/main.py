@@ -1,22 +1,58 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-import requests
+import logging
+import secrets
+import time
 import uuid
 
 import models
 import schemas
-from database import SessionLocal, engine
+import sales
+import products
+import invoices
+import export
+import payload_builder
+from database import AsyncSessionLocal, AsyncWriteSessionLocal, async_engine, engine
 from config import settings
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from datetime import timedelta
+from datetime import date, datetime, timedelta
+from contextlib import asynccontextmanager
 import auth
+import catalog
+import init_db
+import logs
+import metrics
+from logs import dump
 
+logs.configure()
+log = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema before anything touches the database; importing this module never does
+    if settings.DB_INIT_ON_STARTUP:
+        await run_in_threadpool(init_db.init_db)
+    if not fiscal_client.is_configured():
+        log.warning("⚠️ FOCUS_NFE_TOKEN não configurado: as emissões vão falhar")
+    else:
+        log.info("🔑 Focus NFe em %s (token %s...)", settings.FOCUS_NFE_URL, settings.FOCUS_NFE_TOKEN[:4])
+    # NF-e emission and document download workers live as long as the server process
+    emission_workers.start()
+    document_workers.start()
+    webhook_buffer.start()
+    yield
+    # Pending webhooks are written before the workers go away
+    webhook_buffer.stop()
+    document_workers.stop()
+    emission_workers.stop()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -26,53 +62,132 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
+# Outermost, so the latency covers CORS and every other middleware
+app.add_middleware(metrics.MetricsMiddleware, server_timing=settings.METRICS_SERVER_TIMING)
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+# Dependency: the session is closed (and rolled back if not committed) even
+# when the route raises
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Routes that write: on SQLite the transaction starts with BEGIN IMMEDIATE
+async def get_write_db():
+    async with AsyncWriteSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def _get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalar_one_or_none()
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def invalidate_cached_users(mapper, connection, target):
+    # A username can change too, so drop everything rather than a single key
+    auth.user_cache.clear()
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except auth.JWTError:
+    claims = auth.decode_access_token(token)
+    if claims is None:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == username).first()
+    username = claims["sub"]
+
+    user = auth.user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        # Only a cache miss opens a DB session
+        async with AsyncSessionLocal() as db:
+            db_user = await _get_user_by_username(db, username)
+            if db_user is None:
+                raise credentials_exception
+            user = schemas.User.model_validate(db_user)
+        auth.user_cache.set(username, user)
     return user
 
+# Same token, but optional: routes scoped to a branch fall back to the default one
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+async def get_tenant_id(token: Optional[str] = Depends(optional_oauth2_scheme)) -> int:
+    """Filial da requisição, do claim "tenant" do JWT; sem token, 401 (a filial padrão com TENANT_REQUIRED=0)."""
+    if token is None:
+        if settings.TENANT_REQUIRED:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        return models.DEFAULT_TENANT_ID
+    # Only the signature is checked: no user lookup on every scoped request
+    claims = auth.decode_access_token(token)
+    if claims is None:
+        raise HTTPException(
+            status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"}
+        )
+    return auth.tenant_of(claims)
+
+async def _rehash_password(user: models.User, password: str):
+    """
+    Regrava o hash com o BCRYPT_ROUNDS atual. Best effort: pool do bcrypt
+    cheio ou banco travado não derrubam o login, fica para o próximo.
+    """
+    try:
+        hashed_password = await auth.get_password_hash_async(password)
+    except auth.PasswordPoolSaturated:
+        return
+    # Own short write transaction: upgrading the login's read snapshot to a
+    # writer fails under WAL (SQLITE_BUSY_SNAPSHOT) when another write landed
+    # in between. Core UPDATE, so only this user's cache entry is dropped
+    # instead of the whole cache (invalidate_cached_users), and a password
+    # changed meanwhile is not overwritten.
+    try:
+        async with AsyncWriteSessionLocal() as db:
+            await db.execute(
+                update(models.User)
+                .where(models.User.id == user.id, models.User.hashed_password == user.hashed_password)
+                .values(hashed_password=hashed_password)
+            )
+            await db.commit()
+    except OperationalError as e:
+        log.info("Rehash da senha de %s adiado: %s", user.username, e.orig)
+        return
+    auth.user_cache.invalidate(user.username)
+
 @app.post("/token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    # bcrypt runs in its own pool, off the event loop
+    user = await _get_user_by_username(db, form_data.username)
+    try:
+        valid = user is not None and await auth.verify_password_async(form_data.password, user.hashed_password)
+    except auth.PasswordPoolSaturated:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many logins in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    if not valid:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    if auth.needs_rehash(user.hashed_password):
+        await _rehash_password(user, form_data.password)
+
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "tenant": user.tenant_id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(get_current_user)):
     return current_user
 
 
@@ -80,21 +195,112 @@ async def read_users_me(current_user: models.User = Depends(get_current_user)):
 def read_root():
     return {"message": "ERP API is running"}
 
+for _name in ("size", "hits", "misses", "hit_rate"):
+    metrics.add_gauge(
+        f"erp_user_cache_{_name}", f"auth.user_cache: {_name}.",
+        lambda name=_name: auth.user_cache.stats()[name],
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # Prometheus text exposition format, this process only
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/products/", response_model=schemas.Product)
-def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    db_product = models.Product(**product.model_dump())
+async def create_product(
+    product: schemas.ProductCreate, db: AsyncSession = Depends(get_write_db), tenant_id: int = Depends(get_tenant_id)
+):
+    db_product = models.Product(**product.model_dump(), tenant_id=tenant_id)
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    await db.commit()
+    await db.refresh(db_product)
     return db_product
 
-@app.get("/products/", response_model=List[schemas.Product])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = db.query(models.Product).offset(skip).limit(limit).all()
-    return products
+@app.get("/products/search", response_model=List[schemas.Product])
+async def search_products(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+    tenant_id: int = Depends(get_tenant_id),
+):
+    return await db.run_sync(products.search_products, tenant_id, q, limit)
+
+@app.get("/products/")
+async def read_products(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    ncm: Optional[str] = None,
+    cfop: Optional[str] = None,
+    in_stock: bool = False,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    tenant_id: int = Depends(get_tenant_id),
+):
+    try:
+        page, next_after_id = await db.run_sync(
+            products.list_products, tenant_id, limit, after_id=after_id, name_prefix=name_prefix,
+            ncm=ncm, cfop=cfop, in_stock=in_stock, fields=fields,
+        )
+    except products.InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Keep the body a plain list for existing clients; the cursor goes in a header
+    if next_after_id is not None:
+        response.headers["X-Next-Cursor"] = str(next_after_id)
+    return page
+
+@app.get("/catalog")
+def read_catalog(
+    request: Request,
+    tenant_id: int = Depends(get_tenant_id),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+):
+    # Precomputed at deploy (catalog.py): no database
+    snapshot = catalog.snapshot_for(tenant_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Snapshot do catálogo não gerado (python catalog.py)")
+    if token is None:
+        # Default branch without a token (TENANT_REQUIRED=0): the same for everyone, the CDN caches it
+        cache_control = f"public, max-age=60, s-maxage={settings.CATALOG_MAX_AGE}"
+    else:
+        # One branch's catalog: kept out of shared caches, a Vary on the token is not enough
+        cache_control = "private, max-age=60"
+    headers = {
+        "ETag": snapshot.etag,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding, Authorization",
+    }
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    if snapshot.gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(snapshot.gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(snapshot.body, media_type="application/json", headers=headers)
 
-from fiscal import fiscal_client
+from fiscal import fiscal_client, is_focus_url
+from emission import emission_workers
+from documents import document_workers
+from webhooks import webhook_buffer
 from pydantic import BaseModel
+import emission
+import documents
+import company
+from company import company_cache
+
+def _drain_queues(max_seconds: float) -> dict:
+    # Emission first: an NF-e authorized right away queues its documents
+    deadline = time.monotonic() + max_seconds
+    sent = emission_workers.drain(max_seconds)
+    stored = document_workers.drain(max(deadline - time.monotonic(), 0))
+    return {"emission": sent, "documents": stored}
+
+async def _run_queues(workers):
+    if settings.SERVERLESS:
+        # No worker threads: the instance may be frozen right after the
+        # response, so the queued jobs go out inside this request
+        await run_in_threadpool(_drain_queues, settings.QUEUE_DRAIN_SECONDS)
+    else:
+        workers.notify()
 
 class SalePayload(BaseModel):
     id: str
@@ -103,16 +309,56 @@ class SalePayload(BaseModel):
     total: float
 
 @app.post("/fiscal/emit")
-def emit_fiscal_document(sale: SalePayload):
+async def emit_fiscal_document(
+    sale: SalePayload, db: AsyncSession = Depends(get_write_db), tenant_id: int = Depends(get_tenant_id)
+):
+    if not fiscal_client.is_configured():
+        return {
+            "status": "erro_configuracao",
+            "message": "Token da API Fiscal não configurado no .env"
+        }
+
+    # One NF-e per sale: the ref is derived from the sale, so a second click
+    # returns the note already queued instead of emitting it twice
+    ref = f"venda-{sale.id}"
+    existing = await db.get(models.Invoice, ref)
+    if existing:
+        if existing.tenant_id != tenant_id:
+            raise HTTPException(status_code=409, detail="Venda já faturada por outra filial")
+        return {"ref": ref, "status": existing.status}
+
+    # NCM/CFOP/unidade of every line in one query
+    product_ids = [item["id"] for item in sale.items if str(item.get("id", "")).isdigit()]
+    rows = await db.execute(
+        select(models.Product.id, models.Product.ncm, models.Product.cfop, models.Product.unit)
+        .where(models.Product.tenant_id == tenant_id, models.Product.id.in_([int(i) for i in product_ids]))
+    )
+    catalog = {row.id: row for row in rows}
+    emitter = await _emitter(db, tenant_id)
+
     try:
-        result = fiscal_client.emit_nfe(sale.model_dump())
-        return result
+        payload, total_value = fiscal_client.build_nfe_payload(sale.model_dump(), catalog, emitter)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    db.add(models.Invoice(
+        ref=ref,
+        tenant_id=tenant_id,
+        sale_id=int(sale.id) if sale.id.isdigit() else None,
+        source="venda",
+        status="processando",
+        issued_at=datetime.now(),
+        recipient_name="Consumidor Final",
+        total_value=total_value
+    ))
+    emission.enqueue(db, ref, payload)
+    await db.commit()
+    await _run_queues(emission_workers)
+    return {"ref": ref, "status": "processando"}
+
 @app.get("/settings/company", response_model=schemas.CompanySettings)
-def read_company_settings(db: Session = Depends(get_db)):
-    settings = db.query(models.CompanySettings).first()
+async def read_company_settings(db: AsyncSession = Depends(get_db), tenant_id: int = Depends(get_tenant_id)):
+    settings = (company_cache.cached(tenant_id) or await db.run_sync(company_cache.refresh, tenant_id)).settings
     if not settings:
         # Return empty/default if not found, or raise 404. 
         # For simplicity, let's return a default structure or handle it in frontend.
@@ -121,38 +367,78 @@ def read_company_settings(db: Session = Depends(get_db)):
     return settings
 
 @app.post("/settings/company", response_model=schemas.CompanySettings)
-def create_or_update_company_settings(settings: schemas.CompanySettingsCreate, db: Session = Depends(get_db)):
-    db_settings = db.query(models.CompanySettings).first()
+async def create_or_update_company_settings(
+    settings: schemas.CompanySettingsCreate,
+    db: AsyncSession = Depends(get_write_db),
+    tenant_id: int = Depends(get_tenant_id),
+):
+    db_settings = (await db.execute(
+        select(models.CompanySettings).where(models.CompanySettings.tenant_id == tenant_id)
+    )).scalar_one_or_none()
     if db_settings:
         # Update existing
         for key, value in settings.model_dump().items():
             setattr(db_settings, key, value)
     else:
         # Create new
-        db_settings = models.CompanySettings(**settings.model_dump())
+        db_settings = models.CompanySettings(**settings.model_dump(), tenant_id=tenant_id)
         db.add(db_settings)
+    # Other workers see the new version on their next check
+    await db.run_sync(company.bump_version, tenant_id)
     
-    db.commit()
-    db.refresh(db_settings)
+    await db.commit()
+    company_cache.invalidate(tenant_id)
+    await db.refresh(db_settings)
     return db_settings
 
 @app.post("/sales")
-def process_sale(sale: schemas.SaleCreate, db: Session = Depends(get_db)):
-    # Validate stock first
-    for item in sale.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-        if product.quantity < item.quantity:
-            raise HTTPException(status_code=400, detail=f"Insufficient stock for product {product.name}")
-    
-    # Deduct stock
-    for item in sale.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        product.quantity -= item.quantity
-    
-    db.commit()
-    return {"message": "Sale processed and stock updated"}
+async def process_sale(
+    sale: schemas.SaleCreate, db: AsyncSession = Depends(get_write_db), tenant_id: int = Depends(get_tenant_id)
+):
+    try:
+        sale_id, date, total = await db.run_sync(sales.record_sale, tenant_id, sale.items)
+    except sales.ProductNotFound as e:
+        raise HTTPException(status_code=404, detail=f"Product {', '.join(map(str, e.product_ids))} not found")
+    except sales.InsufficientStock as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail={"message": str(e), "shortages": e.shortages})
+
+    await db.commit()
+    return {"message": "Sale processed and stock updated", "sale_id": sale_id, "date": date, "total": total}
+
+@app.get("/sales/export")
+async def export_sales(
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    gzip: bool = False,
+    tenant_id: int = Depends(get_tenant_id),
+):
+    # One row per sale line, with the sale date
+    conditions = [models.Sale.tenant_id == tenant_id, *export.date_range(models.Sale.date, date_from, date_to)]
+    return _export_response(export.sale_lines_query(conditions), "vendas", format, gzip, date_from, date_to)
+
+@app.get("/sales", response_model=schemas.SalePage)
+async def list_sales(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    tenant_id: int = Depends(get_tenant_id),
+):
+    try:
+        page, next_cursor = await db.run_sync(sales.list_sales, tenant_id, limit, cursor)
+    except sales.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"items": page, "next_cursor": next_cursor}
+
+class ManualInvoiceLine(BaseModel):
+    codigo: Optional[str] = None
+    nome: str
+    ncm: str
+    cfop: str
+    price: float
+    quantity: float
+    unidade: str = "un"
 
 # Strict schema for manual invoice - MUST match frontend exactly
 class ManualInvoiceSchema(BaseModel):
@@ -177,12 +463,31 @@ class ManualInvoiceSchema(BaseModel):
     # Override de numeração (Opcional)
     numero_nfe: Optional[str] = None
     
-    # Dados do Item
-    item_nome: str
-    item_ncm: str
-    item_cfop: str
-    item_price: float
-    item_quantity: int
+    # Dados do Item (formulário com um item só)
+    item_nome: Optional[str] = None
+    item_ncm: Optional[str] = None
+    item_cfop: Optional[str] = None
+    item_price: Optional[float] = None
+    item_quantity: Optional[int] = None
+    
+    # Notas com vários itens: quando informado, substitui os campos item_*
+    itens: List[ManualInvoiceLine] = []
+
+def _manual_lines(body: ManualInvoiceSchema) -> List[payload_builder.Line]:
+    if body.itens:
+        return [
+            payload_builder.Line(
+                code=line.codigo or f"ITEM{number:02d}",
+                description=line.nome,
+                ncm=line.ncm,
+                cfop=line.cfop,
+                quantity=line.quantity,
+                unit_price=line.price,
+                unit=line.unidade,
+            )
+            for number, line in enumerate(body.itens, 1)
+        ]
+    return [payload_builder.Line("ITEM01", body.item_nome, body.item_ncm, body.item_cfop, body.item_quantity, body.item_price)]
 
 # Helper function to build destinatario with correct CPF/CNPJ key
 def _build_destinatario(body: ManualInvoiceSchema):
@@ -233,246 +538,315 @@ def _build_destinatario(body: ManualInvoiceSchema):
     
     return destinatario
 
+async def _emitter(db: AsyncSession, tenant_id: int) -> payload_builder.Emitter:
+    """Perfil compilado do emitente da filial (CNPJ só dígitos, UF, tributos do regime)."""
+    # Only touches the database when the branch's cached profile is due for a version check
+    return (company_cache.cached(tenant_id) or await db.run_sync(company_cache.refresh, tenant_id)).emitter
+
+def _validate_manual_invoice(body: ManualInvoiceSchema) -> List[str]:
+    """Erros que a SEFAZ rejeitaria de qualquer jeito, checados antes de enfileirar."""
+    errors = []
+    if len("".join(filter(str.isdigit, body.cpf_cnpj))) not in (11, 14):
+        errors.append("cpf_cnpj deve ter 11 (CPF) ou 14 (CNPJ) dígitos")
+    if len(body.uf.strip()) != 2:
+        errors.append("uf deve ter 2 letras")
+    if len("".join(filter(str.isdigit, body.cep))) != 8:
+        errors.append("cep deve ter 8 dígitos")
+
+    if not body.itens and None in (body.item_nome, body.item_ncm, body.item_cfop, body.item_price, body.item_quantity):
+        errors.append("informe os campos item_* ou a lista itens")
+        return errors
+    for number, line in enumerate(_manual_lines(body), 1):
+        prefix = f"item {number}: " if body.itens else "item_"
+        if not (line.ncm.isdigit() and len(line.ncm) == 8):
+            errors.append(f"{prefix}ncm deve ter 8 dígitos")
+        if not (line.cfop.isdigit() and len(line.cfop) == 4):
+            errors.append(f"{prefix}cfop deve ter 4 dígitos")
+        if line.quantity <= 0:
+            errors.append(f"{prefix}quantity deve ser maior que zero")
+        if line.unit_price <= 0:
+            errors.append(f"{prefix}price deve ser maior que zero")
+    return errors
+
+def _build_manual_payload(body: ManualInvoiceSchema, emitter: payload_builder.Emitter):
+    """(payload, valor total) de uma nota avulsa com um ou vários itens."""
+    return payload_builder.build_payload(
+        emitter,
+        _manual_lines(body),
+        payload_builder.manual_recipient(body),
+        numero=body.numero_nfe,
+    )
+
+def _invoice_row(tenant_id: int, ref: str, body: ManualInvoiceSchema, issued_at: datetime, total_value: float):
+    """Linha de Invoice de uma nota manual recém-enfileirada."""
+    return {"ref": ref, "tenant_id": tenant_id, "source": "manual", "status": "processando", "issued_at": issued_at,
+            "recipient_name": body.nome, "total_value": total_value}
+
 @app.post("/fiscal/issue-manual")
-def issue_manual_invoice(body: ManualInvoiceSchema):
-    import json
-    from datetime import datetime
-    
-    # DEBUG CRITICAL: Show what Python received
-    print('=' * 80)
-    print(f"DEBUG PYTHON RECEBEU: {body.model_dump()}")
-    print('=' * 80)
+async def issue_manual_invoice(
+    body: ManualInvoiceSchema, db: AsyncSession = Depends(get_write_db), tenant_id: int = Depends(get_tenant_id)
+):
+    log.debug("Nota manual recebida: %s", dump(body.model_dump()))
+
+    errors = _validate_manual_invoice(body)
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
     
     # Sanitize CPF/CNPJ (Remove formatting)
     body.cpf_cnpj = "".join(filter(str.isdigit, body.cpf_cnpj))
     
     try:
         # Get company CNPJ
-        db = SessionLocal()
-        company = db.query(models.CompanySettings).first()
-        db.close()
-        
-        cnpj_emitente = company.cnpj if company else settings.FOCUS_NFE_CNPJ
-        cnpj_emitente = "".join(filter(str.isdigit, cnpj_emitente)) if cnpj_emitente else ""
-        uf_emitente = company.uf if company and company.uf else "SC" # Fallback to SC if missing
-        
-        print(f"🏢 CNPJ EMITENTE: {cnpj_emitente} | UF: {uf_emitente}")
-        
-        # Determine Local Destino (1=Internal, 2=Interstate, 3=International)
-        uf_destinatario = body.uf.upper().strip()
-        local_destino = 1 if uf_emitente.upper().strip() == uf_destinatario else 2
-        
-        # Auto-adjust CFOP for Interstate
-        item_cfop = body.item_cfop
-        if local_destino == 2 and item_cfop.startswith('5'):
-            item_cfop = '6' + item_cfop[1:]
-            print(f"🔄 CFOP Ajustado para Interestadual: {body.item_cfop} -> {item_cfop}")
-        
+        emitter = await _emitter(db, tenant_id)
+
         # Generate clean reference ID for URL param
         ref_id = uuid.uuid4().hex
         
-        # BUILD PAYLOAD MANUALLY - SEM HELPERS
-        # CRÍTICO: Montar o destinatario EXATAMENTE como a API espera
-        payload = {
-            "natureza_operacao": "Venda de Mercadoria",
-            "data_emissao": datetime.now().isoformat(),
-            "tipo_documento": 1,
-            "local_destino": local_destino,
-            "finalidade_emissao": 1,
-            "consumidor_final": 1 if body.indicador_inscricao_estadual == "9" else 0,  # 1 for consumer final when not contributor
-            "presenca_comprador": 1,
-            "modalidade_frete": 9,
-            "cnpj_emitente": cnpj_emitente,  # OBRIGATÓRIO: CNPJ da empresa emitente
-            # Se o usuário informou um número manual, usa ele
-            **({"numero": body.numero_nfe} if body.numero_nfe else {}),
-            # DESTINATARIO FLATTENED (Raiz do Payload)
-            # A API exige campos planos com sufixo _destinatario
-            "nome_destinatario": body.nome,
-            "logradouro_destinatario": body.logradouro,
-            "numero_destinatario": body.numero,
-            "bairro_destinatario": body.bairro,
-            "municipio_destinatario": body.municipio,
-            "uf_destinatario": body.uf,
-            "cep_destinatario": body.cep,
-            "telefone_destinatario": body.telefone if body.telefone else "",
-            "indicador_inscricao_estadual_destinatario": body.indicador_inscricao_estadual,
-            "inscricao_estadual_destinatario": body.inscricao_estadual if body.inscricao_estadual else "",
-            "codigo_municipio_destinatario": body.codigo_municipio if body.codigo_municipio else "4205407",
-            # Campos de país (opcionais/padrão)
-            #"pais_destinatario": "BRASIL", 
-            #"codigo_pais_destinatario": "1058",
-            
-            # CPF/CNPJ Dinâmico
-            ("cnpj_destinatario" if len(body.cpf_cnpj) > 11 else "cpf_destinatario"): body.cpf_cnpj,
-            "itens": [
-                {
-                    "numero_item": 1,
-                    "codigo_produto": "ITEM01",
-                    "descricao": body.item_nome,
-                    "codigo_ncm": body.item_ncm,
-                    "cfop": item_cfop, # FIXED: Use adjusted CFOP
-                    "unidade_comercial": "un",
-                    "quantidade_comercial": body.item_quantity,
-                    "valor_unitario_comercial": body.item_price,
-                    "unidade_tributavel": "un",
-                    "quantidade_tributavel": body.item_quantity,
-                    "valor_unitario_tributavel": body.item_price,
-                    "icms_origem": "0",
-                    "icms_situacao_tributaria": "102",
-                    # PIS e COFINS (Obrigatórios mesmo para Simples Nacional em alguns casos)
-                    "pis_situacao_tributaria": "99",
-                    "pis_valor_base": 0.00,
-                    "pis_aliquota": 0.00,
-                    "pis_valor": 0.00,
-                    "cofins_situacao_tributaria": "99",
-                    "cofins_valor_base": 0.00,
-                    "cofins_aliquota": 0.00,
-                    "cofins_valor": 0.00
-                }
-            ]
-        }
-        
-        # DEBUG VISUAL - MOSTRAR JSON COMPLETO
-        print('=' * 80)
-        print('📦 PAYLOAD COMPLETO QUE SERÁ ENVIADO:')
-        print('=' * 80)
-        print(json.dumps(payload, indent=2, ensure_ascii=False))
-        print('=' * 80)
-        print('=' * 80)
-        
-        # FIXED: Use production URL (company is registered in Production Trial)
-        # The "homologação" series in company settings ensures test mode
-        base_url = "https://api.focusnfe.com.br/v2"
-        url = f"{base_url}/nfe?ref={ref_id}"
-        
-        print(f"URL DE ENVIO (PRODUCTION): {url}")
-        print('=' * 80)
-        
-        # Save invoice to database for webhook tracking
-        db_invoice = models.ManualInvoice(
-            ref=ref_id,
-            status="processando",
-            created_at=datetime.now().isoformat(),
-            recipient_name=body.nome,
-            total_value=body.item_price * body.item_quantity
-        )
-        db = SessionLocal()
-        db.add(db_invoice)
-        db.commit()
-        db.close()
-        
-        # Send to Focus NFe
-        response = requests.post(url, json=payload, auth=(settings.FOCUS_NFE_TOKEN, ""))
-        
-        print(f"RESPONSE STATUS CODE: {response.status_code}")
-        print(f"RESPONSE COMPLETA:")
-        print(response.text)
-        print('=' * 80)
-        
-        if response.status_code in [401, 403]:
-            raise HTTPException(status_code=401, detail="Erro de autenticação com Focus NFe")
-        
-        try:
-            result = response.json()
-            print(f"RESPONSE JSON PARSED:")
-            print(json.dumps(result, indent=2, ensure_ascii=False))
-            print('=' * 80)
-            
-            # Persist to Financial Invoice Table
-            # We save it regardless of status (authorized or processing) to track it
-            db = SessionLocal()
-            
-            # Check if already exists (should not, as ref is new)
-            existing = db.query(models.Invoice).filter(models.Invoice.ref == ref_id).first()
-            
-            if not existing:
-                new_invoice = models.Invoice(
-                    ref=ref_id,
-                    status=result.get('status'),
-                    number=result.get('numero'),
-                    series=result.get('serie'),
-                    access_key=result.get('chave_nfe'),
-                    pdf_url=f"https://api.focusnfe.com.br{result.get('caminho_danfe')}" if result.get('caminho_danfe') else None,
-                    xml_url=f"https://api.focusnfe.com.br{result.get('caminho_xml_nota_fiscal')}" if result.get('caminho_xml_nota_fiscal') else None,
-                    issued_at=datetime.now().isoformat(),
-                    recipient_name=body.nome,
-                    total_value=body.item_price * body.item_quantity
-                )
-                db.add(new_invoice)
-                db.commit()
-            db.close()
-            
-            return result
-        except:
-            if response.status_code >= 400:
-                raise HTTPException(status_code=response.status_code, detail=response.text)
-            return {"raw_response": response.text}
+        payload, total_value = _build_manual_payload(body, emitter)
+        log.debug("📦 Payload da nota %s (emitente %s/%s): %s", ref_id, emitter.cnpj, emitter.uf, dump(payload))
+
+        # Track the invoice and queue its submission in one transaction; the
+        # emission workers talk to Focus and the webhook brings the final status
+        db.add(models.Invoice(**_invoice_row(tenant_id, ref_id, body, datetime.now(), total_value)))
+        emission.enqueue(db, ref_id, payload)
+        await db.commit()
+        await _run_queues(emission_workers)
+        log.info("🧾 Nota manual %s enfileirada (R$ %.2f)", ref_id, total_value)
+
+        return {"ref": ref_id, "status": "processando"}
             
     except HTTPException:
         raise
     except Exception as e:
-        print(f"ERRO INESPERADO: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Erro inesperado na emissão manual")
         raise HTTPException(status_code=500, detail=str(e))
 
+MAX_BATCH_INVOICES = 1000
+
+class ManualInvoiceBatch(BaseModel):
+    invoices: List[ManualInvoiceSchema]
+
+def _prepare_batch(
+    tenant_id: int, invoices: List[ManualInvoiceSchema], emitter: payload_builder.Emitter, issued_at: datetime
+):
+    """Valida e monta todas as notas do lote: (results, invoice_rows, jobs)."""
+    results = []
+    invoice_rows, jobs = [], []
+    for index, body in enumerate(invoices):
+        errors = _validate_manual_invoice(body)
+        if errors:
+            results.append({"index": index, "status": "invalido", "errors": errors})
+            continue
+
+        body.cpf_cnpj = "".join(filter(str.isdigit, body.cpf_cnpj))
+        ref_id = uuid.uuid4().hex
+        payload, total_value = _build_manual_payload(body, emitter)
+        invoice_rows.append(_invoice_row(tenant_id, ref_id, body, issued_at, total_value))
+        jobs.append((ref_id, payload))
+        results.append({"index": index, "ref": ref_id, "status": "processando"})
+    return results, invoice_rows, jobs
+
+@app.post("/fiscal/issue-batch")
+async def issue_invoice_batch(
+    batch: ManualInvoiceBatch, db: AsyncSession = Depends(get_write_db), tenant_id: int = Depends(get_tenant_id)
+):
+    """
+    Emissão em lote (ex.: faturamento mensal de um distribuidor).
+
+    Valida todas as notas antes de gravar qualquer coisa; as válidas entram
+    na fila de emissão numa única transação (INSERTs em lote) e os workers
+    enviam para a Focus com concorrência limitada. A resposta traz o
+    resultado de cada nota, na ordem do pedido.
+    """
+    if not batch.invoices:
+        raise HTTPException(status_code=400, detail="Lote vazio")
+    if len(batch.invoices) > MAX_BATCH_INVOICES:
+        raise HTTPException(status_code=413, detail=f"Máximo de {MAX_BATCH_INVOICES} notas por lote")
+
+    emitter = await _emitter(db, tenant_id)
+    # Building up to MAX_BATCH_INVOICES payloads is CPU work: keep it off the event loop
+    results, invoice_rows, jobs = await run_in_threadpool(
+        _prepare_batch, tenant_id, batch.invoices, emitter, datetime.now()
+    )
+
+    if jobs:
+        await db.execute(insert(models.Invoice.__table__), invoice_rows)
+        await db.run_sync(emission.enqueue_many, jobs)
+        await db.commit()
+        await _run_queues(emission_workers)
+
+    return {
+        "accepted": len(jobs),
+        "rejected": len(batch.invoices) - len(jobs),
+        "results": results,
+    }
+
 # --- FINANCIAL MODULE ROUTES ---
 
-@app.get("/invoices")
-def list_invoices():
-    db = SessionLocal()
+@app.get("/invoices", response_model=schemas.InvoicePage)
+async def list_invoices(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    recipient: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    tenant_id: int = Depends(get_tenant_id),
+):
+    # Most recent first; PDF/XML URLs come from GET /invoices/{ref}
+    filters = {"tenant_id": tenant_id, "status": status, "date_from": date_from, "date_to": date_to, "recipient": recipient}
     try:
-        # Return most recent first
-        invoices = db.query(models.Invoice).order_by(models.Invoice.issued_at.desc()).all()
-        return invoices
-    finally:
-        db.close()
+        page, next_cursor = await db.run_sync(invoices.list_invoices, limit, cursor, **filters)
+    except invoices.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Totals scan the whole filtered range: once per listing, not per page
+    totals = None if cursor else await db.run_sync(invoices.status_totals, **filters)
+    return {"items": page, "next_cursor": next_cursor, "totals": totals}
+
+def _export_response(query, name: str, fmt: str, compress: bool, date_from: Optional[date], date_to: Optional[date]):
+    period = "_".join(d.isoformat() for d in (date_from, date_to) if d) or "completo"
+    filename = f"{name}_{period}.{fmt}" + (".gz" if compress else "")
+    return StreamingResponse(
+        export.stream_export(query, fmt, compress),
+        media_type="application/gzip" if compress else export.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Declared before /invoices/{ref} so "export" is not taken for a ref
+@app.get("/invoices/export")
+async def export_invoices(
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    status: Optional[str] = None,
+    gzip: bool = False,
+    tenant_id: int = Depends(get_tenant_id),
+):
+    conditions = [models.Invoice.tenant_id == tenant_id, *export.date_range(models.Invoice.issued_at, date_from, date_to)]
+    if status:
+        conditions.append(models.Invoice.status == status)
+    return _export_response(export.invoices_query(conditions), "notas", format, gzip, date_from, date_to)
+
+@app.get("/invoices/export/documents")
+async def export_invoice_documents(
+    kind: str = Query("all", pattern="^(xml|pdf|all)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    tenant_id: int = Depends(get_tenant_id),
+):
+    # ZIP of the locally stored files; notes not downloaded yet are left out
+    kinds = list(documents.KINDS) if kind == "all" else [kind]
+    period = "_".join(d.isoformat() for d in (date_from, date_to) if d) or "completo"
+    return StreamingResponse(
+        documents.zip_documents(tenant_id, kinds, date_from, date_to),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="documentos_{period}.zip"'},
+    )
+
+async def _branch_invoice(db: AsyncSession, ref: str, tenant_id: int) -> Optional[models.Invoice]:
+    """A nota, se for da filial; a de outra filial é tratada como inexistente."""
+    invoice = await db.get(models.Invoice, ref)
+    return invoice if invoice is not None and invoice.tenant_id == tenant_id else None
+
+async def _invoice_document(ref: str, kind: str, request: Request, db: AsyncSession, tenant_id: int):
+    invoice = await _branch_invoice(db, ref, tenant_id)
+    if invoice is None:
+        raise HTTPException(status_code=404, detail="Documento não encontrado")
+    document = await db.run_sync(documents.get_document, ref, kind)
+    if document is None:
+        # Not downloaded yet: fall back to the Focus URL while the worker catches up
+        url = invoice.xml_url if kind == "xml" else invoice.pdf_url
+        # Only to the Focus host: older rows may hold URLs a forged webhook wrote
+        if not is_focus_url(url):
+            raise HTTPException(status_code=404, detail="Documento não encontrado")
+        return RedirectResponse(url, status_code=307)
+
+    # Content-addressed: the hash is a strong ETag and the file never changes
+    etag = f'"{document.sha256}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    _, media_type, suffix = documents.KINDS[kind]
+    return FileResponse(
+        documents.path_for(document.sha256),
+        media_type=media_type,
+        filename=f"{ref}{suffix}",
+        content_disposition_type="inline",
+        headers=headers,
+    )
+
+@app.get("/invoices/{ref}/xml")
+async def get_invoice_xml(
+    ref: str, request: Request, db: AsyncSession = Depends(get_db), tenant_id: int = Depends(get_tenant_id)
+):
+    return await _invoice_document(ref, "xml", request, db, tenant_id)
+
+@app.get("/invoices/{ref}/pdf")
+async def get_invoice_pdf(
+    ref: str, request: Request, db: AsyncSession = Depends(get_db), tenant_id: int = Depends(get_tenant_id)
+):
+    return await _invoice_document(ref, "pdf", request, db, tenant_id)
+
+@app.get("/invoices/{ref}")
+async def get_invoice(ref: str, db: AsyncSession = Depends(get_db), tenant_id: int = Depends(get_tenant_id)):
+    # Polling alternative to the webhook while the note is queued/processing
+    invoice = await _branch_invoice(db, ref, tenant_id)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Nota fiscal não encontrada")
+    job = await db.get(models.EmissionJob, ref)
+    return {
+        "invoice": invoice,
+        "queue": {
+            "attempts": job.attempts,
+            "next_attempt_at": job.next_attempt_at,
+            "last_error": job.last_error,
+        } if job else None,
+    }
 
 class CancelReason(BaseModel):
     justification: str
 
 @app.delete("/invoices/{ref}")
-def cancel_invoice(ref: str, body: CancelReason):
+async def cancel_invoice(
+    ref: str, body: CancelReason, db: AsyncSession = Depends(get_db), tenant_id: int = Depends(get_tenant_id)
+):
     if len(body.justification) < 15:
         raise HTTPException(status_code=400, detail="Justificativa deve ter pelo menos 15 caracteres")
         
-    db = SessionLocal()
-    invoice = db.query(models.Invoice).filter(models.Invoice.ref == ref).first()
+    invoice = await _branch_invoice(db, ref, tenant_id)
     
     if not invoice:
-        db.close()
         raise HTTPException(status_code=404, detail="Nota fiscal não encontrada")
+    # Don't hold a SQLite read snapshot (or the write lock) across the Focus call
+    await db.commit()
         
     # Call Focus NFe API to cancel
     # DELETE https://api.focusnfe.com.br/v2/nfe/{ref}?justificativa={justification}
-    url = f"{settings.FOCUS_NFE_URL}/nfe/{ref}"
-    
-    print(f"🚫 CANCELANDO NFe: {ref}")
-    print(f"Justificativa: {body.justification}")
+    log.info("🚫 Cancelando NFe %s", ref)
+    log.debug("Justificativa de %s: %s", ref, body.justification)
     
     try:
         # Focus API expects justification in the BODY for DELETE
-        response = requests.delete(
-            url, 
-            json={"justificativa": body.justification},
-            auth=(settings.FOCUS_NFE_TOKEN, "")
+        response = await run_in_threadpool(
+            fiscal_client.request, "DELETE", f"/nfe/{ref}", json={"justificativa": body.justification}
         )
         
-        print(f"Cancel Status: {response.status_code}")
-        print(response.text)
+        log.info("Cancelamento de %s: HTTP %s", ref, response.status_code)
+        log.debug("Resposta do cancelamento de %s: %s", ref, response.text)
         
         if response.status_code in [200, 201]:
             # Update local status
             invoice.status = "cancelado"
-            db.commit()
+            await db.commit()
             return {"message": "Nota fiscal cancelada com sucesso", "details": response.json()}
         else:
             raise HTTPException(status_code=response.status_code, detail=response.text)
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 # Webhook Schema for Focus NFe notifications - Schema completo
 class FocusWebhookPayload(BaseModel):
@@ -488,47 +862,25 @@ class FocusWebhookPayload(BaseModel):
     cnpj_emitente: str = None  # CNPJ do emitente (opcional)
 
 @app.post("/webhook/focus")
-def receive_focus_webhook(payload: FocusWebhookPayload):
-    import json
-    
-    print(f"🔔 WEBHOOK RECEBIDO: {payload.ref} - {payload.status}")
-    print(json.dumps(payload.dict(), indent=2))
-    
-    db = SessionLocal()
-    
-    # Update ManualInvoice (Legacy)
-    invoice = db.query(models.ManualInvoice).filter(models.ManualInvoice.ref == payload.ref).first()
-    if invoice:
-        invoice.status = payload.status
-        invoice.status_sefaz = payload.status_sefaz
-        invoice.mensagem_sefaz = payload.mensagem_sefaz
-        
-        if payload.caminho_danfe:
-            invoice.danfe_url = f"https://api.focusnfe.com.br{payload.caminho_danfe}"
-            
-        if payload.caminho_xml_nota_fiscal:
-            invoice.xml_url = f"https://api.focusnfe.com.br{payload.caminho_xml_nota_fiscal}"
-            
-        db.commit()
-        print(f"✅ ManualInvoice {payload.ref} atualizada para {payload.status}")
-        
-    # Update Invoice (Financial Module)
-    fin_invoice = db.query(models.Invoice).filter(models.Invoice.ref == payload.ref).first()
-    if fin_invoice:
-        fin_invoice.status = payload.status
-        if payload.numero: fin_invoice.number = payload.numero
-        if payload.chave_nfe: fin_invoice.access_key = payload.chave_nfe
-        
-        if payload.caminho_danfe:
-            fin_invoice.pdf_url = f"https://api.focusnfe.com.br{payload.caminho_danfe}"
-            
-        if payload.caminho_xml_nota_fiscal:
-            fin_invoice.xml_url = f"https://api.focusnfe.com.br{payload.caminho_xml_nota_fiscal}"
-            
-        db.commit()
-        print(f"✅ Financial Invoice {payload.ref} atualizada para {payload.status}")
-    
-    db.close()
-    
+async def receive_focus_webhook(payload: FocusWebhookPayload):
+    # Acknowledged right away: webhooks.py dedupes, coalesces and writes the
+    # buffered callbacks in one transaction every WEBHOOK_FLUSH_MS
+    webhook_buffer.add(payload.model_dump())
+    if settings.SERVERLESS:
+        # The instance may be frozen right after the response: nothing can
+        # wait for the flush thread
+        await run_in_threadpool(webhook_buffer.flush)
+        await _run_queues(document_workers)
     return {"received": True}
 
+
+@app.get("/jobs/drain")
+async def drain_queues(request: Request):
+    # Serverless leftovers (retries, the tail of large batches): the Vercel
+    # cron calls this with CRON_SECRET as a bearer token
+    if not settings.CRON_SECRET:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {settings.CRON_SECRET}"
+    if not secrets.compare_digest(request.headers.get("authorization", ""), expected):
+        raise HTTPException(status_code=401, detail="Invalid cron secret")
+    return await run_in_threadpool(_drain_queues, settings.QUEUE_DRAIN_SECONDS)
@@ -0,0 +1,181 @@
+"""
+Métricas do processo no formato texto do Prometheus (GET /metrics).
+
+MetricsMiddleware mede cada requisição por rota (o template, ex.
+/invoices/{ref}, não a URL) e abre um RequestStats no contexto: os eventos
+do SQLAlchemy (instrument_engine) e as chamadas à Focus (FocusNFeClient)
+somam nele o tempo e a quantidade de queries e de chamadas externas daquela
+requisição. Com METRICS_SERVER_TIMING=1 o mesmo resumo vai no header
+Server-Timing, visível na aba Network do navegador.
+
+Cada processo do uvicorn tem os seus contadores; o Prometheus soma os alvos.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            base = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{{{base + ',' if base else ''}{le}}} {cumulative}")
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {values[-1]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "erp_http_request_duration_seconds", "Tempo de resposta por rota.",
+    ("method", "route", "status"), LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    "erp_http_request_db_queries", "Queries SQL por requisição.", ("method", "route"), COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "erp_http_request_db_seconds", "Tempo somado no banco por requisição.", ("method", "route"), LATENCY_BUCKETS,
+)
+QUERY_SECONDS = Histogram("erp_db_query_duration_seconds", "Tempo de cada query SQL.", (), QUERY_BUCKETS)
+FOCUS_SECONDS = Histogram(
+    "erp_focus_request_duration_seconds", "Chamadas à API da Focus NFe (inclui os retries do pool).",
+    ("operation", "method", "status"), LATENCY_BUCKETS,
+)
+HISTOGRAMS = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, QUERY_SECONDS, FOCUS_SECONDS]
+
+# Extra gauges (name -> (help, callable returning a number)), e.g. cache hit counts
+GAUGES: Dict[str, tuple] = {}
+
+
+class RequestStats:
+    __slots__ = ("db_queries", "db_seconds", "focus_calls", "focus_seconds")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.focus_calls = 0
+        self.focus_seconds = 0.0
+
+    def server_timing(self, total: float) -> str:
+        return (
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.db_queries} queries", '
+            f'focus;dur={self.focus_seconds * 1000:.1f};desc="{self.focus_calls} chamadas", '
+            f"total;dur={total * 1000:.1f}"
+        )
+
+
+# Set by the middleware; worker threads outside a request see None
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def add_gauge(name: str, help: str, read: Callable[[], float]):
+    GAUGES[name] = (help, read)
+
+
+def observe_focus(operation: str, method: str, status, seconds: float):
+    FOCUS_SECONDS.observe((operation, method, str(status)), seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.focus_calls += 1
+        stats.focus_seconds += seconds
+
+
+def instrument_engine(sync_engine):
+    """Mede cada query do engine (no async, passe engine.sync_engine)."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _end(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        QUERY_SECONDS.observe((), elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += elapsed
+
+
+def render() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    for name, (help, read) in GAUGES.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {read()}"]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI puro: não bufferiza o corpo, então não atrasa as exportações em streaming."""
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    value = stats.server_timing(time.perf_counter() - start).encode("latin-1")
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", value)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            # The template keeps the label set bounded; unknown URLs share one series
+            route = scope.get("route")
+            path = getattr(route, "path", "desconhecida")
+            method = scope["method"]
+            REQUEST_SECONDS.observe((method, path, str(status)), elapsed)
+            REQUEST_QUERIES.observe((method, path), stats.db_queries)
+            REQUEST_DB_SECONDS.observe((method, path), stats.db_seconds)
+            _current.reset(token)
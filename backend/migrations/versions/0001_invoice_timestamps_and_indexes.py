@@ -0,0 +1,116 @@
+"""Typed invoice timestamps and the indexes the app already declares
+
+Invoice.issued_at and ManualInvoice.created_at were String columns holding
+datetime.isoformat(); they become DateTime and existing rows are rewritten in
+the format the dialect expects (on SQLite only the values are rewritten).
+Also creates the indexes that create_all only adds to new tables: the
+financial screen ones on invoices, plus the products indexes used by
+GET /products/.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_CHUNK = 10000
+
+# (table, primary key, column)
+TIMESTAMP_COLUMNS = [
+    ("invoices", "ref", "issued_at"),
+    ("manual_invoices", "id", "created_at"),
+]
+
+# (table, index name, columns, unique)
+INDEXES = [
+    ("invoices", "ix_invoices_issued_at_ref", ["issued_at", "ref"], False),
+    ("invoices", "ix_invoices_status_issued_at", ["status", "issued_at"], False),  # Replaced in 0002
+    ("invoices", "ix_invoices_access_key", ["access_key"], True),
+    ("invoices", "ix_invoices_sale_id", ["sale_id"], False),
+    ("manual_invoices", "ix_manual_invoices_created_at", ["created_at"], False),
+    ("products", "ix_products_ncm", ["ncm"], False),
+]
+
+
+def _parse(value):
+    if not value:
+        return None
+    try:
+        # Offsets are dropped: the app has always written local naive times
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _backfill(table: str, pk: str, column: str):
+    """Reescreve as strings ISO como DateTime, em blocos pela chave primária."""
+    conn = op.get_bind()
+    raw = sa.table(table, sa.column(pk), sa.column(column, sa.String))
+    typed = sa.table(table, sa.column(pk), sa.column(column, sa.DateTime))
+    update = (
+        sa.update(typed)
+        .where(typed.c[pk] == sa.bindparam("pk"))
+        .values({column: sa.bindparam("value", type_=sa.DateTime)})
+    )
+    last = None
+    while True:
+        query = sa.select(raw.c[pk], raw.c[column]).order_by(raw.c[pk]).limit(BACKFILL_CHUNK)
+        if last is not None:
+            query = query.where(raw.c[pk] > last)
+        rows = conn.execute(query).all()
+        if not rows:
+            break
+        conn.execute(update, [{"pk": key, "value": _parse(value)} for key, value in rows])
+        last = rows[-1][0]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    tables = set(inspector.get_table_names())
+
+    for table, pk, column in TIMESTAMP_COLUMNS:
+        if table not in tables:
+            continue
+        if conn.dialect.name == "sqlite":
+            # SQLite stores DateTime as text anyway, so only the values change.
+            # Changing the declared type through batch mode would CAST the old
+            # strings to NUMERIC ('2025-11-23T21:01' -> 2025).
+            _backfill(table, pk, column)
+            continue
+        current = {c["name"]: c["type"] for c in inspector.get_columns(table)}
+        if not isinstance(current.get(column), sa.DateTime):
+            op.alter_column(
+                table, column, type_=sa.DateTime(), existing_type=sa.String(),
+                postgresql_using=f"NULLIF({column}, '')::timestamp",
+            )
+
+    for table, name, columns, unique in INDEXES:
+        if table not in tables:
+            continue
+        if name not in {ix["name"] for ix in sa.inspect(conn).get_indexes(table)}:
+            op.create_index(name, table, columns, unique=unique)
+
+    if "products" in tables:
+        # Expression index: created in SQL so it matches models.py exactly
+        op.execute("CREATE INDEX IF NOT EXISTS ix_products_name_lower ON products (lower(name))")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_products_name_lower")
+    for table, name, columns, unique in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
+    if op.get_bind().dialect.name != "sqlite":
+        for table, pk, column in TIMESTAMP_COLUMNS:
+            op.alter_column(table, column, type_=sa.String(), existing_type=sa.DateTime())
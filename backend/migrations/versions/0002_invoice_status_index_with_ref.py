@@ -0,0 +1,41 @@
+"""Add ref to the invoices status index
+
+GET /invoices pages by (issued_at, ref); with ref in the index a status
+filtered page is a pure range scan, without sorting ties on ref.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _indexes():
+    return {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes("invoices")}
+
+
+def upgrade() -> None:
+    if "invoices" not in sa.inspect(op.get_bind()).get_table_names():
+        return
+    existing = _indexes()
+    if "ix_invoices_status_issued_at_ref" not in existing:
+        op.create_index("ix_invoices_status_issued_at_ref", "invoices", ["status", "issued_at", "ref"])
+    if "ix_invoices_status_issued_at" in existing:
+        op.drop_index("ix_invoices_status_issued_at", table_name="invoices")
+
+
+def downgrade() -> None:
+    existing = _indexes()
+    if "ix_invoices_status_issued_at" not in existing:
+        op.create_index("ix_invoices_status_issued_at", "invoices", ["status", "issued_at"])
+    op.drop_index("ix_invoices_status_issued_at_ref", table_name="invoices", if_exists=True)
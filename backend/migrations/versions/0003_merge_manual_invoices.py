@@ -0,0 +1,141 @@
+"""Merge manual_invoices into invoices
+
+Manual notes were written twice, as a manual_invoices row and an invoices row
+with the same ref, and every webhook updated both. invoices gains the columns
+only the manual table had (status_sefaz, mensagem_sefaz) plus `source`;
+manual rows are merged into it and manual_invoices becomes a read-only view
+with the old column names. The legacy integer id is not kept: ref is the key.
+Databases from before the financial module have manual_invoices but no
+invoices table; it is created here (as the models had it at this revision)
+so their notes are merged too.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NEW_COLUMNS = [
+    sa.Column("status_sefaz", sa.String()),
+    sa.Column("mensagem_sefaz", sa.String()),
+    sa.Column("source", sa.String(), nullable=False, server_default="venda"),
+]
+
+# Snapshot of models.MANUAL_INVOICES_VIEW
+MANUAL_INVOICES_VIEW = """
+    CREATE VIEW manual_invoices AS
+    SELECT ref, status, status_sefaz, mensagem_sefaz, pdf_url AS danfe_url, xml_url,
+           issued_at AS created_at, recipient_name, total_value
+    FROM invoices WHERE source = 'manual'
+"""
+
+def _create_invoices():
+    """invoices as models.Invoice declared it at this revision, with its indexes."""
+    op.create_table(
+        "invoices",
+        sa.Column("ref", sa.String(), primary_key=True),
+        sa.Column("sale_id", sa.Integer()),
+        sa.Column("status", sa.String()),
+        *(column.copy() for column in NEW_COLUMNS),
+        sa.Column("number", sa.String()),
+        sa.Column("series", sa.String()),
+        sa.Column("access_key", sa.String()),
+        sa.Column("pdf_url", sa.String()),
+        sa.Column("xml_url", sa.String()),
+        sa.Column("issued_at", sa.DateTime()),
+        sa.Column("recipient_name", sa.String()),
+        sa.Column("total_value", sa.Float()),
+    )
+    op.create_index("ix_invoices_ref", "invoices", ["ref"])
+    op.create_index("ix_invoices_sale_id", "invoices", ["sale_id"])
+    op.create_index("ix_invoices_access_key", "invoices", ["access_key"], unique=True)
+    op.create_index("ix_invoices_issued_at_ref", "invoices", ["issued_at", "ref"])
+    op.create_index("ix_invoices_status_issued_at_ref", "invoices", ["status", "issued_at", "ref"])
+
+
+MERGE = [
+    # Notes tracked in both tables: fill in what only the manual row had. The
+    # invoices status wins, it is the one the financial screen has been showing
+    """
+    UPDATE invoices SET
+        source = 'manual',
+        status = COALESCE(status, (SELECT m.status FROM manual_invoices m WHERE m.ref = invoices.ref)),
+        status_sefaz = (SELECT m.status_sefaz FROM manual_invoices m WHERE m.ref = invoices.ref),
+        mensagem_sefaz = (SELECT m.mensagem_sefaz FROM manual_invoices m WHERE m.ref = invoices.ref),
+        pdf_url = COALESCE(pdf_url, (SELECT m.danfe_url FROM manual_invoices m WHERE m.ref = invoices.ref)),
+        xml_url = COALESCE(xml_url, (SELECT m.xml_url FROM manual_invoices m WHERE m.ref = invoices.ref))
+    WHERE ref IN (SELECT ref FROM manual_invoices)
+    """,
+    # Manual notes issued before the financial module tracked them
+    """
+    INSERT INTO invoices (ref, source, status, status_sefaz, mensagem_sefaz, pdf_url, xml_url,
+                          issued_at, recipient_name, total_value)
+    SELECT ref, 'manual', status, status_sefaz, mensagem_sefaz, danfe_url, xml_url,
+           created_at, recipient_name, total_value
+    FROM manual_invoices
+    WHERE ref IS NOT NULL AND ref NOT IN (SELECT ref FROM invoices)
+    """,
+]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    tables = set(inspector.get_table_names())
+    if "invoices" not in tables:
+        if "manual_invoices" not in tables:
+            # Empty database: create_all builds the current schema
+            return
+        _create_invoices()
+    else:
+        existing = {c["name"] for c in inspector.get_columns("invoices")}
+        for column in NEW_COLUMNS:
+            if column.name not in existing:
+                op.add_column("invoices", column.copy())
+
+    if "manual_invoices" in tables:
+        for statement in MERGE:
+            op.execute(statement)
+        op.drop_index("ix_manual_invoices_created_at", table_name="manual_invoices", if_exists=True)
+        op.drop_table("manual_invoices")
+    if "manual_invoices" not in sa.inspect(conn).get_view_names():
+        op.execute(MANUAL_INVOICES_VIEW)
+
+
+def downgrade() -> None:
+    op.execute("DROP VIEW IF EXISTS manual_invoices")
+    op.create_table(
+        "manual_invoices",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("ref", sa.String(), unique=True),
+        sa.Column("status", sa.String()),
+        sa.Column("status_sefaz", sa.String()),
+        sa.Column("mensagem_sefaz", sa.String()),
+        sa.Column("danfe_url", sa.String()),
+        sa.Column("xml_url", sa.String()),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("recipient_name", sa.String()),
+        sa.Column("total_value", sa.Float()),
+    )
+    op.create_index("ix_manual_invoices_created_at", "manual_invoices", ["created_at"])
+    op.execute(
+        """
+        INSERT INTO manual_invoices (ref, status, status_sefaz, mensagem_sefaz, danfe_url, xml_url,
+                                     created_at, recipient_name, total_value)
+        SELECT ref, status, status_sefaz, mensagem_sefaz, pdf_url, xml_url, issued_at, recipient_name, total_value
+        FROM invoices WHERE source = 'manual'
+        """
+    )
+    with op.batch_alter_table("invoices") as batch:
+        for column in reversed(NEW_COLUMNS):
+            batch.drop_column(column.name)
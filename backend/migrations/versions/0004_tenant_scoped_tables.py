@@ -0,0 +1,163 @@
+"""Branch (tenant) scoped products, sales, invoices, company settings and users
+
+Adds tenant_id to each table, with existing rows in the default branch (1),
+and swaps the listing indexes for ones led by tenant_id, so every branch's
+pages stay range scans. company_settings gets one row per branch. On SQLite
+the products_fts index is rebuilt carrying tenant_id (UNINDEXED) for the
+search filter.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DEFAULT_TENANT_ID = "1"
+
+TABLES = ["products", "sales", "invoices", "company_settings", "users"]
+
+# (table, index name, columns, unique)
+NEW_INDEXES = [
+    ("products", "ix_products_tenant_id_id", ["tenant_id", "id"], False),
+    ("products", "ix_products_tenant_ncm", ["tenant_id", "ncm"], False),
+    ("products", "ix_products_tenant_name_lower", ["tenant_id", sa.text("lower(name)")], False),
+    ("sales", "ix_sales_tenant_date_id", ["tenant_id", "date", "id"], False),
+    ("invoices", "ix_invoices_tenant_issued_at_ref", ["tenant_id", "issued_at", "ref"], False),
+    ("invoices", "ix_invoices_tenant_status_issued_at_ref", ["tenant_id", "status", "issued_at", "ref"], False),
+    ("company_settings", "ix_company_settings_tenant_id", ["tenant_id"], True),
+]
+
+# Replaced by the ones above
+OLD_INDEXES = [
+    ("products", "ix_products_ncm", ["ncm"]),
+    ("products", "ix_products_name_lower", [sa.text("lower(name)")]),
+    ("sales", "ix_sales_date_id", ["date", "id"]),
+    ("invoices", "ix_invoices_issued_at_ref", ["issued_at", "ref"]),
+    ("invoices", "ix_invoices_status_issued_at_ref", ["status", "issued_at", "ref"]),
+]
+
+# Snapshot of models.MANUAL_INVOICES_VIEW (dropped around the invoices rebuild on downgrade)
+MANUAL_INVOICES_VIEW = """
+    CREATE VIEW manual_invoices AS
+    SELECT ref, status, status_sefaz, mensagem_sefaz, pdf_url AS danfe_url, xml_url,
+           issued_at AS created_at, recipient_name, total_value
+    FROM invoices WHERE source = 'manual'
+"""
+
+FTS_TRIGGERS = ["products_fts_ai", "products_fts_ad", "products_fts_au"]
+
+
+def _fts_ddl(columns, unindexed=()):
+    """Snapshot of models.PRODUCT_SEARCH_DDL for the given columns."""
+    names = ", ".join(columns)
+    declared = ", ".join(f"{c} UNINDEXED" if c in unindexed else c for c in columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    return [
+        f"""
+        CREATE VIRTUAL TABLE products_fts USING fts5(
+            {declared},
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3 4 5 6'
+        )
+        """,
+        f"""
+        CREATE TRIGGER products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, {names}) VALUES (new.id, {new});
+        END
+        """,
+        f"""
+        CREATE TRIGGER products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, {names}) VALUES ('delete', old.id, {old});
+        END
+        """,
+        f"""
+        CREATE TRIGGER products_fts_au AFTER UPDATE OF {names} ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, {names}) VALUES ('delete', old.id, {old});
+            INSERT INTO products_fts(rowid, {names}) VALUES (new.id, {new});
+        END
+        """,
+        "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+    ]
+
+
+def _fts_sql(conn):
+    return conn.execute(sa.text("SELECT sql FROM sqlite_master WHERE name = 'products_fts'")).scalar()
+
+
+def _rebuild_fts(columns, unindexed=()):
+    for trigger in FTS_TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS products_fts")
+    for statement in _fts_ddl(columns, unindexed):
+        op.execute(statement)
+
+
+def _indexes(conn, table):
+    if conn.dialect.name == "sqlite":
+        # The inspector skips expression indexes (lower(name)) on SQLite
+        query = sa.text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table")
+        return {name for (name,) in conn.execute(query, {"table": table})}
+    return {ix["name"] for ix in sa.inspect(conn).get_indexes(table)}
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    tables = set(sa.inspect(conn).get_table_names())
+
+    for table in TABLES:
+        if table in tables and "tenant_id" not in {c["name"] for c in sa.inspect(conn).get_columns(table)}:
+            op.add_column(
+                table, sa.Column("tenant_id", sa.Integer(), nullable=False, server_default=DEFAULT_TENANT_ID)
+            )
+
+    for table, name, columns, unique in NEW_INDEXES:
+        if table in tables and name not in _indexes(conn, table):
+            op.create_index(name, table, columns, unique=unique)
+    for table, name, _ in OLD_INDEXES:
+        if table in tables and name in _indexes(conn, table):
+            op.drop_index(name, table_name=table)
+
+    if conn.dialect.name == "sqlite" and "products" in tables:
+        sql = _fts_sql(conn)
+        if sql is None or "tenant_id" not in sql:
+            _rebuild_fts(["name", "ncm", "tenant_id"], unindexed=["tenant_id"])
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    tables = set(sa.inspect(conn).get_table_names())
+    sqlite = conn.dialect.name == "sqlite"
+
+    for table, name, _, _ in NEW_INDEXES:
+        if table in tables and name in _indexes(conn, table):
+            op.drop_index(name, table_name=table)
+    if sqlite:
+        # Rebuilding products drops its triggers anyway; they come back below
+        for trigger in FTS_TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    # The view would point at the invoices table the batch rebuild drops
+    op.execute("DROP VIEW IF EXISTS manual_invoices")
+
+    for table in TABLES:
+        if table in tables and "tenant_id" in {c["name"] for c in sa.inspect(conn).get_columns(table)}:
+            with op.batch_alter_table(table) as batch:
+                batch.drop_column("tenant_id")
+
+    op.execute(MANUAL_INVOICES_VIEW)
+    for table, name, columns in OLD_INDEXES:
+        if table in tables and name not in _indexes(conn, table):
+            op.create_index(name, table, columns)
+    if sqlite and "products" in tables:
+        _rebuild_fts(["name", "ncm"])
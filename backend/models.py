@@ -1,10 +1,20 @@
-from sqlalchemy import Column, Integer, String, Float
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Index, UniqueConstraint, func, event, inspect, text
+from sqlalchemy.orm import relationship
 from database import Base
 
+# Branch (one CNPJ) that owns a row. Rows from before multi-tenancy, and
+# requests without a token (only with TENANT_REQUIRED=0), belong to this one
+DEFAULT_TENANT_ID = 1
+
+def tenant_column(**kw):
+    return Column(Integer, nullable=False, default=DEFAULT_TENANT_ID, server_default=str(DEFAULT_TENANT_ID), **kw)
+
 class Product(Base):
     __tablename__ = "products"
 
     id = Column(Integer, primary_key=True, index=True)
+    tenant_id = tenant_column()
     name = Column(String, index=True)
     quantity = Column(Integer)
     price = Column(Float)
@@ -12,10 +22,99 @@ class Product(Base):
     cfop = Column(String, default="5102")
     unit = Column(String, default="un")
 
+    __table_args__ = (
+        # GET /products/ walks one branch's catalog by id (keyset) and filters by NCM
+        Index("ix_products_tenant_id_id", "tenant_id", "id"),
+        Index("ix_products_tenant_ncm", "tenant_id", "ncm"),
+    )
+
+# Case-insensitive name prefix filter on GET /products/
+Index("ix_products_tenant_name_lower", Product.tenant_id, func.lower(Product.name))
+
+# Full-text index for GET /products/search (SQLite FTS5, external content).
+# remove_diacritics folds accents, so "pelicula" finds "Película"; the prefix
+# indexes serve the "term"* lookups the POS sends while the cashier types.
+# tenant_id is stored UNINDEXED: it is not searchable, only read back to keep
+# the hits of the caller's branch (products.search_products filters on it).
+PRODUCT_SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, ncm, tenant_id UNINDEXED,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4 5 6'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, ncm, tenant_id) VALUES (new.id, new.name, new.ncm, new.tenant_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, ncm, tenant_id)
+        VALUES ('delete', old.id, old.name, old.ncm, old.tenant_id);
+    END
+    """,
+    # Only name/ncm/tenant_id feed the index; stock updates from /sales must not touch it
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, ncm, tenant_id ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, ncm, tenant_id)
+        VALUES ('delete', old.id, old.name, old.ncm, old.tenant_id);
+        INSERT INTO products_fts(rowid, name, ncm, tenant_id) VALUES (new.id, new.name, new.ncm, new.tenant_id);
+    END
+    """,
+]
+
+@event.listens_for(Base.metadata, "after_create")
+def create_product_search_index(target, connection, **kw):
+    if connection.dialect.name != "sqlite":
+        return
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(products)"))}
+    if "tenant_id" not in columns:
+        # Database from before migration 0004, which rebuilds the index itself
+        return
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+    ).first()
+    for statement in PRODUCT_SEARCH_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        # Index rows that were already in the catalog before the FTS table existed
+        connection.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+class Sale(Base):
+    __tablename__ = "sales"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = tenant_column()
+    date = Column(DateTime, nullable=False, default=datetime.now)
+    total = Column(Float)
+
+    items = relationship("SaleItem", order_by="SaleItem.id")
+
+    __table_args__ = (
+        # Keyset pagination for GET /sales walks one branch's (date, id) backwards
+        Index("ix_sales_tenant_date_id", "tenant_id", "date", "id"),
+    )
+
+class SaleItem(Base):
+    __tablename__ = "sale_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sale_id = Column(Integer, ForeignKey("sales.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    name = Column(String)
+    quantity = Column(Integer)
+    unit_price = Column(Float)
+    subtotal = Column(Float)
+
 class CompanySettings(Base):
     __tablename__ = "company_settings"
 
     id = Column(Integer, primary_key=True, index=True)
+    # One emitter profile per branch
+    tenant_id = tenant_column(unique=True, index=True)
     cnpj = Column(String, unique=True, index=True)
     ie = Column(String)
     razao_social = Column(String)
@@ -28,35 +127,93 @@ class CompanySettings(Base):
     cep = Column(String)
     regime_tributario = Column(Integer, default=1) # 1=Simples Nacional
 
-class ManualInvoice(Base):
-    __tablename__ = "manual_invoices"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    ref = Column(String, unique=True, index=True)
-    status = Column(String, default="processando")  # processando, autorizado, erro_autorizacao, cancelado
-    status_sefaz = Column(String)
-    mensagem_sefaz = Column(String)
-    danfe_url = Column(String)
-    xml_url = Column(String)
-    created_at = Column(String)
-    recipient_name = Column(String)
-    total_value = Column(Float)
+# Bumped on every write to a cached table (company.py), so each uvicorn worker
+# notices the change with one primary-key read instead of reloading the row
+class SettingsVersion(Base):
+    __tablename__ = "settings_version"
+
+    name = Column(String, primary_key=True)  # "company_settings:<tenant_id>"
+    version = Column(Integer, nullable=False, default=0)
 
 class Invoice(Base):
     __tablename__ = "invoices"
 
     ref = Column(String, primary_key=True, index=True)
-    sale_id = Column(Integer, nullable=True)
+    tenant_id = tenant_column()
+    sale_id = Column(Integer, nullable=True, index=True)
     status = Column(String) # autorizado, cancelado, erro
+    status_sefaz = Column(String)
+    mensagem_sefaz = Column(String)
+    # "venda" (/fiscal/emit) or "manual" (/fiscal/issue-manual, /fiscal/issue-batch)
+    source = Column(String, nullable=False, default="venda", server_default="venda")
     number = Column(String)
     series = Column(String)
-    access_key = Column(String)
+    access_key = Column(String, unique=True, index=True)  # NULL until authorized
     pdf_url = Column(String)
     xml_url = Column(String)
-    issued_at = Column(String) # Storing as ISO string for simplicity
+    issued_at = Column(DateTime, default=datetime.now)
     recipient_name = Column(String)
     total_value = Column(Float)
 
+# Financial screen: one branch's notes, newest first, optionally filtered by
+# status. The ref column makes (issued_at, ref) a stable sort key for paging.
+Index("ix_invoices_tenant_issued_at_ref", Invoice.tenant_id, Invoice.issued_at, Invoice.ref)
+Index("ix_invoices_tenant_status_issued_at_ref", Invoice.tenant_id, Invoice.status, Invoice.issued_at, Invoice.ref)
+
+# Manual notes used to live in their own manual_invoices table, written
+# alongside invoices on every event. They are invoices rows now; the view
+# keeps the old shape for reports and ad-hoc queries that still read it.
+MANUAL_INVOICES_VIEW = """
+    CREATE VIEW manual_invoices AS
+    SELECT ref, status, status_sefaz, mensagem_sefaz, pdf_url AS danfe_url, xml_url,
+           issued_at AS created_at, recipient_name, total_value
+    FROM invoices WHERE source = 'manual'
+"""
+
+@event.listens_for(Base.metadata, "after_create")
+def create_manual_invoices_view(target, connection, **kw):
+    inspector = inspect(connection)
+    # An old manual_invoices table is left for migration 0003 to merge
+    if "manual_invoices" in inspector.get_view_names() or "manual_invoices" in inspector.get_table_names():
+        return
+    connection.execute(text(MANUAL_INVOICES_VIEW))
+
+# NF-e waiting to be submitted to Focus NFe by the emission workers (emission.py)
+class EmissionJob(Base):
+    __tablename__ = "emission_queue"
+
+    ref = Column(String, primary_key=True)
+    payload = Column(Text, nullable=False)  # JSON sent to POST /v2/nfe
+    attempts = Column(Integer, nullable=False, default=0)
+    # Due time; a worker that claims the job pushes it forward by the lease,
+    # so a crashed worker's job comes back on its own
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+    last_error = Column(String)
+
+# NF-e XML/DANFE downloaded from Focus NFe; the file lives on disk under its
+# SHA-256 (documents.py), so identical files are stored once
+class InvoiceDocument(Base):
+    __tablename__ = "invoice_documents"
+
+    ref = Column(String, primary_key=True)
+    kind = Column(String, primary_key=True)  # "xml" or "pdf"
+    sha256 = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    stored_at = Column(DateTime, nullable=False, default=datetime.now)
+
+# Documents waiting to be downloaded by the document workers (documents.py)
+class DocumentJob(Base):
+    __tablename__ = "document_queue"
+    __table_args__ = (UniqueConstraint("ref", "kind"),)
+
+    id = Column(Integer, primary_key=True)
+    ref = Column(String, nullable=False)
+    kind = Column(String, nullable=False)
+    path = Column(String, nullable=False)  # caminho_* returned by Focus
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+    last_error = Column(String)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -64,4 +221,6 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     full_name = Column(String, nullable=True)
+    # Goes into the JWT: every request made with the token works on this branch
+    tenant_id = tenant_column()
 
@@ -0,0 +1,176 @@
+"""
+Montagem do payload de NF-e da Focus NFe, com N itens, para venda do PDV,
+nota avulsa e lote.
+
+Tudo o que depende só da empresa (CNPJ, UF, tributos padrão do regime) é
+"compilado" uma vez por emitente em compile_emitter() e reaproveitado em cada
+item e em cada nota. Por item sobra só um merge de dict, o que deixa notas
+de 10 mil itens em poucos milissegundos (ver bench_payload.py).
+"""
+import math
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+DEFAULT_NCM = "85171231"
+DEFAULT_CFOP = "5102"
+DEFAULT_UNIT = "un"
+DEFAULT_CODIGO_MUNICIPIO = "4205407"  # Florianópolis
+
+# Tributos padrão por item, por CompanySettings.regime_tributario
+SIMPLES_NACIONAL_TAXES = {
+    "icms_origem": "0",
+    "icms_situacao_tributaria": "102",  # CSOSN 102: Simples sem permissão de crédito
+    # PIS e COFINS (Obrigatórios mesmo para Simples Nacional em alguns casos)
+    "pis_situacao_tributaria": "99",
+    "pis_valor_base": 0.00,
+    "pis_aliquota": 0.00,
+    "pis_valor": 0.00,
+    "cofins_situacao_tributaria": "99",
+    "cofins_valor_base": 0.00,
+    "cofins_aliquota": 0.00,
+    "cofins_valor": 0.00,
+}
+
+REGIME_NORMAL_TAXES = {
+    "icms_origem": "0",
+    "icms_situacao_tributaria": "90",  # Outras: alíquotas reais vêm do contador
+    "pis_situacao_tributaria": "99",
+    "pis_valor_base": 0.00,
+    "pis_aliquota": 0.00,
+    "pis_valor": 0.00,
+    "cofins_situacao_tributaria": "99",
+    "cofins_valor_base": 0.00,
+    "cofins_aliquota": 0.00,
+    "cofins_valor": 0.00,
+}
+
+# 1=Simples Nacional, 2=Simples (excesso de sublimite), 3=Regime Normal
+TAXES_BY_REGIME = {1: SIMPLES_NACIONAL_TAXES, 2: SIMPLES_NACIONAL_TAXES, 3: REGIME_NORMAL_TAXES}
+
+
+class Line(NamedTuple):
+    code: str
+    description: str
+    ncm: str
+    cfop: str
+    quantity: float
+    unit_price: float
+    unit: str = DEFAULT_UNIT
+
+
+class Emitter(NamedTuple):
+    cnpj: str
+    uf: str
+    regime: int
+    item_defaults: Dict[str, object]
+
+
+@lru_cache(maxsize=64)
+def compile_emitter(cnpj: str, uf: str, regime: int) -> Emitter:
+    """Perfil do emitente com os tributos padrão do regime já resolvidos (memoizado por empresa)."""
+    cnpj = "".join(filter(str.isdigit, cnpj or ""))
+    uf = (uf or "SC").upper().strip()
+    taxes = TAXES_BY_REGIME.get(regime or 1, SIMPLES_NACIONAL_TAXES)
+    return Emitter(cnpj, uf, regime or 1, dict(taxes))
+
+
+@lru_cache(maxsize=256)
+def interstate_cfop(cfop: str) -> str:
+    # 5xxx (saída dentro do estado) -> 6xxx (saída para outro estado)
+    return "6" + cfop[1:] if cfop.startswith("5") else cfop
+
+
+def manual_recipient(body) -> Dict[str, object]:
+    """Campos *_destinatario (planos, na raiz do payload) de uma nota avulsa."""
+    cpf_cnpj = "".join(filter(str.isdigit, body.cpf_cnpj))
+    return {
+        "nome_destinatario": body.nome,
+        "logradouro_destinatario": body.logradouro,
+        "numero_destinatario": body.numero,
+        "bairro_destinatario": body.bairro,
+        "municipio_destinatario": body.municipio,
+        "uf_destinatario": body.uf,
+        "cep_destinatario": body.cep,
+        "telefone_destinatario": body.telefone if body.telefone else "",
+        "indicador_inscricao_estadual_destinatario": body.indicador_inscricao_estadual,
+        "inscricao_estadual_destinatario": body.inscricao_estadual if body.inscricao_estadual else "",
+        "codigo_municipio_destinatario": body.codigo_municipio if body.codigo_municipio else DEFAULT_CODIGO_MUNICIPIO,
+        # CPF/CNPJ Dinâmico
+        ("cnpj_destinatario" if len(cpf_cnpj) > 11 else "cpf_destinatario"): cpf_cnpj,
+    }
+
+
+def consumer_recipient(emitter: Emitter) -> Dict[str, object]:
+    """Venda de balcão sem identificação do comprador."""
+    return {
+        "nome_destinatario": "Consumidor Final",
+        "uf_destinatario": emitter.uf,
+        "indicador_inscricao_estadual_destinatario": "9",
+    }
+
+
+def line_totals(lines: List[Line]) -> Tuple[List[float], float]:
+    """valor_bruto de cada linha e o total da nota, numa passada só."""
+    totals = [round(quantity * unit_price, 2) for _, _, _, _, quantity, unit_price, _ in lines]
+    return totals, round(math.fsum(totals), 2)
+
+
+def build_payload(
+    emitter: Emitter,
+    lines: Iterable[Line],
+    recipient: Dict[str, object],
+    natureza_operacao: str = "Venda de Mercadoria",
+    numero: Optional[str] = None,
+    data_emissao: Optional[str] = None,
+) -> Tuple[dict, float]:
+    """
+    Payload de POST /v2/nfe para N itens. Retorna (payload, valor total).
+
+    Se o destinatário é de outra UF, todos os CFOPs 5xxx viram 6xxx.
+    """
+    lines = list(lines)
+    uf_destinatario = str(recipient.get("uf_destinatario") or emitter.uf).upper().strip()
+    # Determine Local Destino (1=Internal, 2=Interstate, 3=International)
+    local_destino = 1 if uf_destinatario == emitter.uf else 2
+    cfop_for = interstate_cfop if local_destino == 2 else str
+
+    totals, total = line_totals(lines)
+    defaults = emitter.item_defaults
+    # Tuple unpacking instead of attribute access: this loop is the hot path
+    itens = [
+        {
+            **defaults,
+            "numero_item": number,
+            "codigo_produto": code,
+            "descricao": description,
+            "codigo_ncm": ncm,
+            "cfop": cfop_for(cfop),
+            "unidade_comercial": unit,
+            "quantidade_comercial": quantity,
+            "valor_unitario_comercial": unit_price,
+            "unidade_tributavel": unit,
+            "quantidade_tributavel": quantity,
+            "valor_unitario_tributavel": unit_price,
+            "valor_bruto": line_total,
+        }
+        for number, (code, description, ncm, cfop, quantity, unit_price, unit), line_total
+        in zip(range(1, len(lines) + 1), lines, totals)
+    ]
+
+    payload = {
+        "natureza_operacao": natureza_operacao,
+        "data_emissao": data_emissao or datetime.now().isoformat(),
+        "tipo_documento": 1,  # 1 - Saída
+        "local_destino": local_destino,
+        "finalidade_emissao": 1,  # 1 - Normal
+        # 1 for consumer final when not contributor
+        "consumidor_final": 1 if recipient.get("indicador_inscricao_estadual_destinatario", "9") == "9" else 0,
+        "presenca_comprador": 1,
+        "modalidade_frete": 9,  # 9 - Sem frete
+        "cnpj_emitente": emitter.cnpj,  # OBRIGATÓRIO: CNPJ da empresa emitente
+        **({"numero": numero} if numero else {}),
+        **recipient,
+        "itens": itens,
+    }
+    return payload, total
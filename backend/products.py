@@ -0,0 +1,140 @@
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+import models
+
+products_table = models.Product.__table__
+
+# tenant_id comes from the token, never from the client
+PRODUCT_FIELDS = [column.name for column in products_table.columns if column.name != "tenant_id"]
+
+# How many matches bm25 ranks per search. Ranking costs about 1.5us per
+# match and a short prefix ("cap", "8517") matches 10k-30k of 100k products:
+# ranking them all takes tens of ms, so only the newest SEARCH_CANDIDATES
+# matches (FTS5 walks rowid DESC natively) are ranked. Queries with fewer
+# matches get the exact bm25 top; broad ones get the best of the newest
+# products, which narrow as the cashier keeps typing (bench_search.py checks
+# both and holds the p99 under 5 ms).
+SEARCH_CANDIDATES = 100
+
+SEARCH_SQL = text("""
+    SELECT p.id, p.name, p.quantity, p.price, p.ncm, p.cfop, p.unit
+    FROM (
+        SELECT rowid, rank FROM products_fts
+        WHERE products_fts MATCH :match AND tenant_id = :tenant_id
+        ORDER BY rowid DESC
+        LIMIT :candidates
+    ) AS hits
+    JOIN products p ON p.id = hits.rowid
+    ORDER BY hits.rank
+    LIMIT :limit
+""")
+
+SEARCH_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+class InvalidFields(Exception):
+    def __init__(self, fields: List[str]):
+        self.fields = fields
+        super().__init__(f"Unknown fields: {', '.join(fields)}")
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Turns ?fields=name,price into a column list. id is always included (it is the cursor)."""
+    if not fields:
+        return PRODUCT_FIELDS
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in PRODUCT_FIELDS]
+    if unknown:
+        raise InvalidFields(unknown)
+    return ["id"] + [field for field in requested if field != "id"]
+
+
+def list_products(
+    db: Session,
+    tenant_id: int,
+    limit: int,
+    after_id: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    ncm: Optional[str] = None,
+    cfop: Optional[str] = None,
+    in_stock: bool = False,
+    fields: Optional[str] = None,
+) -> Tuple[List[dict], Optional[int]]:
+    """
+    Página do catálogo da filial por keyset em Product.id (ix_products_tenant_id_id),
+    com filtros aplicados no banco.
+
+    Só as colunas pedidas em `fields` são selecionadas e as linhas saem como
+    dicts, sem materializar objetos do ORM.
+
+    Retorna (linhas, próximo after_id ou None).
+    """
+    columns = [products_table.c[name] for name in parse_fields(fields)]
+    query = (
+        select(*columns)
+        .where(products_table.c.tenant_id == tenant_id)
+        .order_by(products_table.c.id)
+        .limit(limit + 1)
+    )
+
+    if after_id is not None:
+        query = query.where(products_table.c.id > after_id)
+    if name_prefix:
+        # Range over lower(name) so ix_products_tenant_name_lower can serve the prefix
+        prefix = name_prefix.lower()
+        lowered = func.lower(products_table.c.name)
+        query = query.where(lowered >= prefix, lowered < prefix + "\uffff")
+    if ncm:
+        query = query.where(products_table.c.ncm == ncm)
+    if cfop:
+        query = query.where(products_table.c.cfop == cfop)
+    if in_stock:
+        query = query.where(products_table.c.quantity > 0)
+
+    rows = [dict(row) for row in db.execute(query).mappings()]
+    page = rows[:limit]
+    next_after_id = page[-1]["id"] if len(rows) > limit else None
+    return page, next_after_id
+
+
+def fts_query(q: str) -> Optional[str]:
+    """
+    Converte o texto digitado numa expressão FTS5: cada palavra vira um
+    prefixo entre aspas ("cap"* "ipho"*), todas obrigatórias. Pontuação e
+    operadores do FTS5 digitados pelo usuário são descartados.
+    """
+    terms = SEARCH_TERM.findall(q)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_products(db: Session, tenant_id: int, q: str, limit: int) -> List[dict]:
+    """
+    Busca do PDV a partir do índice products_fts: os SEARCH_CANDIDATES
+    produtos mais novos da filial que casam, ranqueados por bm25.
+    """
+    match = fts_query(q)
+    if match is None:
+        return []
+
+    if db.get_bind().dialect.name != "sqlite":
+        # No FTS5 outside SQLite: plain case-insensitive substring match
+        query = (
+            select(*(products_table.c[name] for name in PRODUCT_FIELDS))
+            .where(products_table.c.tenant_id == tenant_id)
+            .where(products_table.c.name.ilike(f"%{q.strip()}%") | (products_table.c.ncm == q.strip()))
+            .order_by(products_table.c.name)
+            .limit(limit)
+        )
+        return [dict(row) for row in db.execute(query).mappings()]
+
+    # tenant_id is stored UNINDEXED in products_fts: a MATCH term for it would
+    # walk every row of the branch. Filtered before the LIMIT, so the top
+    # candidates are this branch's
+    params = {"match": match, "tenant_id": tenant_id, "candidates": SEARCH_CANDIDATES, "limit": limit}
+    return [dict(row) for row in db.execute(SEARCH_SQL, params).mappings()]
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, select, tuple_, update
+from sqlalchemy.orm import Session, selectinload
+
+import models
+import schemas
+
+products_table = models.Product.__table__
+sales_table = models.Sale.__table__
+sale_items_table = models.SaleItem.__table__
+
+# Re-reads allowed when a concurrent sale wins the race for the same rows
+MAX_ATTEMPTS = 3
+
+# Conditional deduction: the WHERE clause only matches when there is enough
+# stock, so two concurrent checkouts can never take the same unit twice.
+DEDUCT_STOCK = (
+    update(products_table)
+    .where(products_table.c.id == bindparam("b_id"))
+    .where(products_table.c.quantity >= bindparam("b_qty"))
+    .values(quantity=products_table.c.quantity - bindparam("b_qty"))
+)
+
+
+class ProductNotFound(Exception):
+    def __init__(self, product_ids: List[int]):
+        self.product_ids = product_ids
+        super().__init__(f"Products not found: {product_ids}")
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages: List[dict]):
+        # Each entry: product_id, name, requested, available
+        self.shortages = shortages
+        names = ", ".join(s["name"] for s in shortages)
+        super().__init__(f"Insufficient stock for: {names}")
+
+
+def _merge_lines(items: List[schemas.SaleItemCreate]) -> "OrderedDict[int, int]":
+    # The same product can be scanned more than once in a cart
+    merged = OrderedDict()
+    for item in items:
+        merged[item.product_id] = merged.get(item.product_id, 0) + item.quantity
+    return merged
+
+
+def _load_products(db: Session, tenant_id: int, product_ids) -> dict:
+    # Another branch's products are "not found" here
+    rows = db.execute(
+        select(products_table.c.id, products_table.c.name, products_table.c.price, products_table.c.quantity)
+        .where(products_table.c.tenant_id == tenant_id, products_table.c.id.in_(product_ids))
+    ).all()
+    return {row.id: row for row in rows}
+
+
+def _shortages(requested: "OrderedDict[int, int]", products: dict) -> List[dict]:
+    return [
+        {
+            "product_id": product_id,
+            "name": products[product_id].name,
+            "requested": quantity,
+            "available": products[product_id].quantity,
+        }
+        for product_id, quantity in requested.items()
+        if products[product_id].quantity < quantity
+    ]
+
+
+def _apply_deductions(db: Session, lines: List[dict]) -> bool:
+    # executemany when the driver reports a reliable total rowcount (SQLite,
+    # psycopg2); otherwise one statement per line.
+    if db.get_bind().dialect.supports_sane_multi_rowcount:
+        return db.execute(DEDUCT_STOCK, lines).rowcount == len(lines)
+    return all(db.execute(DEDUCT_STOCK, line).rowcount == 1 for line in lines)
+
+
+def deduct_stock(db: Session, tenant_id: int, items: List[schemas.SaleItemCreate]) -> dict:
+    """
+    Valida e baixa o estoque de todos os itens da venda em uma única transação.
+
+    Carrega os produtos com um único SELECT ... IN (...) e faz a baixa com
+    UPDATEs condicionais (quantity >= :q). Se qualquer linha não tiver saldo,
+    nada é alterado e InsufficientStock informa exatamente quais faltaram.
+    Não faz commit: quem chama decide quando fechar a transação.
+
+    Retorna {product_id: row} com id, name, price e quantity (antes da baixa).
+    """
+    requested = _merge_lines(items)
+    if not requested:
+        return {}
+    products = _load_products(db, tenant_id, list(requested))
+
+    missing = [product_id for product_id in requested if product_id not in products]
+    if missing:
+        raise ProductNotFound(missing)
+
+    lines = [{"b_id": product_id, "b_qty": quantity} for product_id, quantity in requested.items()]
+    for _ in range(MAX_ATTEMPTS):
+        # Fail fast without touching the write lock when the snapshot is already short
+        shortages = _shortages(requested, products)
+        if shortages:
+            raise InsufficientStock(shortages)
+
+        if _apply_deductions(db, lines):
+            return products
+
+        # Another checkout changed the stock between the SELECT and the UPDATE
+        db.rollback()
+        products = _load_products(db, tenant_id, list(requested))
+
+    raise InsufficientStock(_shortages(requested, products))
+
+
+def record_sale(db: Session, tenant_id: int, items: List[schemas.SaleItemCreate]) -> Tuple[int, datetime, float]:
+    """
+    Baixa o estoque e grava a venda (cabeçalho + itens) na mesma transação.
+
+    O cabeçalho é um INSERT único e os itens vão num executemany, então o
+    custo não cresce em round-trips com o tamanho do carrinho. Não faz commit.
+
+    Retorna (sale_id, date, total).
+    """
+    products = deduct_stock(db, tenant_id, items)
+
+    lines = []
+    for item in items:
+        product = products[item.product_id]
+        lines.append({
+            "product_id": item.product_id,
+            "name": product.name,
+            "quantity": item.quantity,
+            "unit_price": product.price,
+            "subtotal": round(product.price * item.quantity, 2),
+        })
+    total = round(sum(line["subtotal"] for line in lines), 2)
+    date = datetime.now()
+
+    sale_id = db.execute(insert(sales_table).values(tenant_id=tenant_id, date=date, total=total)).inserted_primary_key[0]
+    if lines:
+        for line in lines:
+            line["sale_id"] = sale_id
+        db.execute(insert(sale_items_table), lines)
+
+    return sale_id, date, total
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(sale: models.Sale) -> str:
+    return f"{sale.date.isoformat()}_{sale.id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        date, sale_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(date), int(sale_id)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def list_sales(
+    db: Session, tenant_id: int, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[models.Sale], Optional[str]]:
+    """
+    Página de vendas da filial, mais recentes primeiro, por keyset em (date, id).
+
+    Cada página é um range scan em ix_sales_tenant_date_id a partir do cursor,
+    então o custo não depende de quantas vendas já existem antes dela.
+    """
+    query = (
+        db.query(models.Sale)
+        .filter(models.Sale.tenant_id == tenant_id)
+        .options(selectinload(models.Sale.items))
+        .order_by(models.Sale.date.desc(), models.Sale.id.desc())
+    )
+    if cursor:
+        query = query.filter(tuple_(models.Sale.date, models.Sale.id) < decode_cursor(cursor))
+
+    # One extra row tells whether there is a next page without a COUNT(*)
+    rows = query.limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(rows) > limit else None
+    return page, next_cursor
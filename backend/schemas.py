@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Dict, Optional, List
+from datetime import datetime
 
 class ProductBase(BaseModel):
     name: str
@@ -36,16 +37,61 @@ class CompanySettingsCreate(CompanySettingsBase):
 
 class CompanySettings(CompanySettingsBase):
     id: int
+    tenant_id: int
 
     class Config:
         from_attributes = True
 
 class SaleItemCreate(BaseModel):
     product_id: int
-    quantity: int
+    # A zero or negative quantity would pass the stock check and add stock back
+    quantity: int = Field(gt=0)
 
 class SaleCreate(BaseModel):
-    items: List[SaleItemCreate]
+    items: List[SaleItemCreate] = Field(min_length=1)
+
+class SaleItem(BaseModel):
+    product_id: int
+    name: str
+    quantity: int
+    unit_price: float
+    subtotal: float
+
+    class Config:
+        from_attributes = True
+
+class Sale(BaseModel):
+    id: int
+    date: datetime
+    total: float
+    items: List[SaleItem]
+
+    class Config:
+        from_attributes = True
+
+class SalePage(BaseModel):
+    items: List[Sale]
+    next_cursor: Optional[str] = None
+
+class InvoiceSummary(BaseModel):
+    ref: str
+    status: Optional[str] = None
+    number: Optional[str] = None
+    series: Optional[str] = None
+    access_key: Optional[str] = None
+    issued_at: Optional[datetime] = None
+    recipient_name: Optional[str] = None
+    total_value: Optional[float] = None
+
+class InvoiceStatusTotal(BaseModel):
+    count: int
+    total_value: float
+
+class InvoicePage(BaseModel):
+    items: List[InvoiceSummary]
+    next_cursor: Optional[str] = None
+    # Only on the first page (no cursor): one aggregate over the whole filter
+    totals: Optional[Dict[str, InvoiceStatusTotal]] = None
 
 class ManualInvoiceItem(BaseModel):
     name: str
@@ -77,6 +123,7 @@ class UserCreate(UserBase):
 
 class User(UserBase):
     id: int
+    tenant_id: int
 
     class Config:
         from_attributes = True
@@ -0,0 +1,176 @@
+"""
+Ingestão do webhook da Focus NFe.
+
+A rota só valida o corpo, entrega aqui e responde: nada de banco no caminho
+da requisição. Os callbacks repetidos (a Focus reenvia, e depois de uma queda
+da SEFAZ chegam em rajada) são descartados pela chave (ref, status,
+protocolo) já gravada; os demais se juntam por ref num buffer em memória que
+uma thread grava a cada WEBHOOK_FLUSH_MS, numa transação só. A chave só
+conta como vista depois do commit: se a gravação falhar, o reenvio da Focus
+ainda entra.
+
+O status de uma nota só anda para frente (STATUS_RANK): um "processando"
+atrasado não desfaz um "autorizado", nem um "autorizado" reenviado desfaz um
+"cancelado".
+
+O buffer vive na memória do processo: o que estiver pendente é gravado no
+shutdown, mas uma queda brusca (ou uma instância serverless congelada) perde
+o que estava na janela. Não é a única via do status: enquanto a nota estiver
+"processando", o job dela continua na fila de emissão consultando
+GET /nfe/{ref} na Focus a cada EMISSION_POLL_SECONDS (emission.py).
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import select
+
+import documents
+import models
+from config import settings
+from database import WriteSessionLocal
+from fiscal import focus_file_url
+
+log = logging.getLogger(__name__)
+
+# Order in which a note's status may move; equal status only refreshes the fields
+STATUS_RANK = {
+    "processando": 0,
+    "processando_autorizacao": 0,
+    "erro_envio": 1,  # ours, when the emission queue gives up
+    "erro_autorizacao": 2,
+    "denegado": 3,
+    "autorizado": 3,
+    "cancelado": 4,
+}
+# Statuses Focus may add later sit right after the in-flight ones
+UNKNOWN_RANK = 1
+
+
+def advances(current: Optional[str], new: str) -> bool:
+    if current is None or current == new:
+        return True
+    return STATUS_RANK.get(new, UNKNOWN_RANK) > STATUS_RANK.get(current, UNKNOWN_RANK)
+
+
+def _apply(invoice: models.Invoice, payload: dict):
+    invoice.status = payload["status"]
+    invoice.status_sefaz = payload.get("status_sefaz") or invoice.status_sefaz
+    invoice.mensagem_sefaz = payload.get("mensagem_sefaz") or invoice.mensagem_sefaz
+    invoice.number = payload.get("numero") or invoice.number
+    invoice.access_key = payload.get("chave_nfe") or invoice.access_key
+    invoice.pdf_url = focus_file_url(payload.get("caminho_danfe")) or invoice.pdf_url
+    invoice.xml_url = focus_file_url(payload.get("caminho_xml_nota_fiscal")) or invoice.xml_url
+
+
+def apply_batch(db, batch: dict) -> tuple:
+    """
+    Aplica {ref: payload} nas notas, lidas com um IN por bloco na chave
+    primária. Não faz commit. Retorna (notas atualizadas, se algum download
+    de XML/DANFE entrou na fila).
+    """
+    refs = list(batch)
+    applied, authorized = 0, set()
+    for start in range(0, len(refs), documents.LOOKUP_CHUNK):
+        chunk = refs[start:start + documents.LOOKUP_CHUNK]
+        for invoice in db.scalars(select(models.Invoice).where(models.Invoice.ref.in_(chunk))):
+            payload = batch[invoice.ref]
+            if not advances(invoice.status, payload["status"]):
+                continue
+            _apply(invoice, payload)
+            applied += 1
+            if payload["status"] == "autorizado":
+                authorized.add(invoice.ref)
+    return applied, documents.enqueue_many(db, {ref: batch[ref] for ref in authorized})
+
+
+class WebhookBuffer:
+    """Callbacks pendentes por ref, gravados em lote por uma thread."""
+
+    def __init__(self, flush_ms: int, max_pending: int, dedupe_size: int):
+        self.flush_seconds = flush_ms / 1000
+        self.max_pending = max_pending
+        self.dedupe_size = dedupe_size
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_keys = set()  # Keys in _pending, seen once committed
+        self._seen = OrderedDict()  # LRU of committed (ref, status, protocolo)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _merge(self, payload: dict):
+        # Caller holds the lock. Within a window the most advanced status wins;
+        # fields it leaves empty keep what the earlier callbacks brought
+        current = self._pending.get(payload["ref"])
+        if current is None:
+            self._pending[payload["ref"]] = payload
+        elif advances(current["status"], payload["status"]):
+            self._pending[payload["ref"]] = {**current, **{k: v for k, v in payload.items() if v is not None}}
+
+    def add(self, payload: dict) -> bool:
+        """Guarda o callback para o próximo flush. Retorna False se era repetido."""
+        key = (payload["ref"], payload["status"], payload.get("protocolo"))
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return False
+            if key in self._pending_keys:
+                return False
+            self._pending_keys.add(key)
+            self._merge(payload)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+        return True
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            keys, self._pending_keys = self._pending_keys, set()
+        if not batch:
+            return 0
+        try:
+            with WriteSessionLocal() as db:
+                applied, queued = apply_batch(db, batch)
+                db.commit()
+        except Exception:
+            log.exception("Falha ao gravar %s webhooks; voltam para o buffer", len(batch))
+            # Back into the buffer for the next window, behind anything newer
+            with self._lock:
+                for payload in batch.values():
+                    self._merge(payload)
+                self._pending_keys |= keys
+            return 0
+        with self._lock:
+            for key in keys:
+                self._seen[key] = None
+            while len(self._seen) > self.dedupe_size:
+                self._seen.popitem(last=False)
+        if queued:
+            documents.document_workers.notify()
+        log.info("🔔 Webhooks: %s notas no lote, %s atualizadas", len(batch), applied)
+        return len(batch)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="webhook-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+webhook_buffer = WebhookBuffer(settings.WEBHOOK_FLUSH_MS, settings.WEBHOOK_MAX_PENDING, settings.WEBHOOK_DEDUPE_SIZE)
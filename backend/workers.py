@@ -0,0 +1,132 @@
+"""
+Filas no banco consumidas por threads: emissão de NF-e (emission.py) e
+download de XML/DANFE (documents.py).
+
+Cada fila é uma tabela com uma chave primária de uma coluna, `attempts` e
+`next_attempt_at`. Um worker reserva o próximo job vencido com um único
+UPDATE ... RETURNING, que empurra o vencimento para frente pelo lease: se o
+processo cair no meio, o job volta sozinho para a fila.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from database import WriteSessionLocal
+
+log = logging.getLogger(__name__)
+
+# Wake-up interval when idle: picks up delayed retries and jobs enqueued by
+# other processes
+IDLE_POLL_SECONDS = 2.0
+
+
+def claim_next(db, table, lease_seconds: float, *columns):
+    """
+    Reserva o próximo job vencido de `table`, atômico entre threads e
+    processos. Retorna a tupla de `columns` (já com attempts incrementado) ou None.
+    """
+    key = table.primary_key.columns[0]
+    now = datetime.now()
+    due = (
+        select(key)
+        .where(table.c.next_attempt_at <= now)
+        .order_by(table.c.next_attempt_at)
+        .limit(1)
+        .scalar_subquery()
+    )
+    row = db.execute(
+        update(table)
+        .where(key == due, table.c.next_attempt_at <= now)
+        .values(
+            attempts=table.c.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=lease_seconds),
+        )
+        .returning(*columns)
+    ).first()
+    db.commit()
+    return tuple(row) if row else None
+
+
+def retry_later(db, table, key, delay: float, error: str):
+    db.execute(
+        update(table)
+        .where(table.primary_key.columns[0] == key)
+        .values(next_attempt_at=datetime.now() + timedelta(seconds=delay), last_error=error[:500])
+    )
+    db.commit()
+
+
+class QueueWorkers:
+    """Threads que consomem uma fila; o tamanho do pool limita o trabalho simultâneo."""
+
+    def __init__(self, name: str, workers: int, claim, process):
+        self.name = name
+        self.workers = workers
+        self.claim = claim
+        self.process = process
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_forever(self):
+        """Roda as threads em primeiro plano até o Ctrl+C (python emission.py, python documents.py)."""
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def notify(self):
+        """Acorda os workers logo após um enqueue, sem esperar o próximo poll."""
+        self._wake.set()
+
+    def drain(self, max_seconds: float) -> int:
+        """
+        Consome a fila na thread de quem chama até ela esvaziar ou o tempo
+        acabar, sem workers (serverless). Retorna quantos jobs processou.
+        """
+        deadline = time.monotonic() + max_seconds
+        processed = 0
+        while time.monotonic() < deadline:
+            try:
+                with WriteSessionLocal() as db:
+                    job = self.claim(db)
+                    if job is None:
+                        break
+                    self.process(db, *job)
+            except Exception:
+                # The job's lease runs out and it is claimed again later
+                log.exception("Erro ao drenar a fila %s", self.name)
+            processed += 1
+        return processed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with WriteSessionLocal() as db:
+                    job = self.claim(db)
+                    if job is not None:
+                        self.process(db, *job)
+                        continue
+            except Exception:
+                log.exception("Erro no worker %s", self.name)
+            self._wake.wait(IDLE_POLL_SECONDS)
+            self._wake.clear()
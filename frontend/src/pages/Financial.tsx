@@ -1,36 +1,78 @@
 import { useState, useEffect } from 'react';
 import { FileText, Trash2, AlertCircle, X } from 'lucide-react';
+import { authFetch } from '../services/api';
 
+// Slim list row: PDF/XML URLs come from GET /invoices/{ref} on demand
 interface Invoice {
   ref: string;
   status: string;
-  number: string;
-  series: string;
-  access_key: string;
-  pdf_url: string;
-  xml_url: string;
+  number: string | null;
+  series: string | null;
+  access_key: string | null;
   issued_at: string;
   recipient_name: string;
   total_value: number;
 }
 
+interface StatusTotal {
+  count: number;
+  total_value: number;
+}
+
+interface InvoicePage {
+  items: Invoice[];
+  next_cursor: string | null;
+  totals: Record<string, StatusTotal> | null;
+}
+
+interface Filters {
+  status: string;
+  date_from: string;
+  date_to: string;
+  recipient: string;
+}
+
+const PAGE_SIZE = 50;
+
+const formatCurrency = (value: number) =>
+  new Intl.NumberFormat('pt-BR', { style: 'currency', currency: 'BRL' }).format(value);
+
 export function Financial() {
   const [invoices, setInvoices] = useState<Invoice[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [totals, setTotals] = useState<Record<string, StatusTotal>>({});
+  const [filters, setFilters] = useState<Filters>({ status: '', date_from: '', date_to: '', recipient: '' });
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [cancelModalOpen, setCancelModalOpen] = useState(false);
   const [selectedInvoice, setSelectedInvoice] = useState<Invoice | null>(null);
   const [justification, setJustification] = useState('');
   const [cancelling, setCancelling] = useState(false);
 
   useEffect(() => {
-    fetchInvoices();
-  }, []);
+    // Debounce typing in the recipient filter
+    const timer = setTimeout(() => fetchInvoices(), 300);
+    return () => clearTimeout(timer);
+  }, [filters]);
+
+  const fetchPage = async (cursor: string | null): Promise<InvoicePage> => {
+    const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value) params.set(key, value);
+    });
+    if (cursor) params.set('cursor', cursor);
+    const response = await authFetch(`/api/invoices?${params}`);
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    return response.json();
+  };
 
   const fetchInvoices = async () => {
+    setLoading(true);
     try {
-      const response = await fetch('/api/invoices');
-      const data = await response.json();
-      setInvoices(data);
+      const data = await fetchPage(null);
+      setInvoices(data.items);
+      setNextCursor(data.next_cursor);
+      setTotals(data.totals || {});
     } catch (error) {
       console.error('Error fetching invoices:', error);
     } finally {
@@ -38,6 +80,48 @@ export function Financial() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const data = await fetchPage(nextCursor);
+      setInvoices((current) => [...current, ...data.items]);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching invoices:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const openPdf = async (invoice: Invoice) => {
+    // A plain link can't carry the Authorization header, so the PDF is fetched
+    // and shown as a blob. The tab is opened now, inside the click, or the
+    // popup blocker would stop it after the await
+    const tab = window.open('', '_blank');
+    if (!tab) return;
+    tab.opener = null;
+    try {
+      // Served from the local copy (or redirected to Focus until it is downloaded)
+      const response = await authFetch(`/api/invoices/${invoice.ref}/pdf`);
+      if (!response.ok) throw new Error(`HTTP ${response.status}`);
+      const url = URL.createObjectURL(await response.blob());
+      tab.location.href = url;
+      setTimeout(() => URL.revokeObjectURL(url), 60_000);
+    } catch (error) {
+      // Focus may not let the redirect be read cross-origin: open its URL directly
+      const response = await authFetch(`/api/invoices/${invoice.ref}`);
+      const pdfUrl = response.ok ? (await response.json()).invoice?.pdf_url : null;
+      if (pdfUrl) {
+        tab.location.href = pdfUrl;
+      } else {
+        tab.close();
+        console.error('Error opening PDF:', error);
+        alert('PDF indisponível para esta nota.');
+      }
+    }
+  };
+
   const handleCancelClick = (invoice: Invoice) => {
     setSelectedInvoice(invoice);
     setJustification('');
@@ -49,7 +133,7 @@ export function Financial() {
 
     setCancelling(true);
     try {
-      const response = await fetch(`/api/invoices/${selectedInvoice.ref}`, {
+      const response = await authFetch(`/api/invoices/${selectedInvoice.ref}`, {
         method: 'DELETE',
         headers: {
           'Content-Type': 'application/json',
@@ -59,7 +143,19 @@ export function Financial() {
 
       if (response.ok) {
         setCancelModalOpen(false);
-        fetchInvoices(); // Refresh list
+        // Update the row and the totals in place instead of reloading the list
+        const cancelled = selectedInvoice;
+        setInvoices((current) =>
+          current.map((invoice) => (invoice.ref === cancelled.ref ? { ...invoice, status: 'cancelado' } : invoice))
+        );
+        setTotals((current) => {
+          const next = { ...current };
+          const from = next[cancelled.status];
+          if (from) next[cancelled.status] = { count: from.count - 1, total_value: from.total_value - cancelled.total_value };
+          const to = next.cancelado || { count: 0, total_value: 0 };
+          next.cancelado = { count: to.count + 1, total_value: to.total_value + cancelled.total_value };
+          return next;
+        });
       } else {
         const error = await response.json();
         alert(`Erro ao cancelar: ${error.detail}`);
@@ -101,6 +197,51 @@ export function Financial() {
         <p className="text-gray-600">Gerenciamento de Notas Fiscais emitidas</p>
       </div>
 
+      <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mb-6">
+        {Object.entries(totals).map(([status, total]) => (
+          <div key={status} className="bg-white rounded-lg shadow p-4">
+            <div className="mb-2">{getStatusBadge(status)}</div>
+            <p className="text-lg font-semibold text-gray-900">{formatCurrency(total.total_value)}</p>
+            <p className="text-xs text-gray-500">{total.count} nota(s)</p>
+          </div>
+        ))}
+      </div>
+
+      <div className="bg-white rounded-lg shadow p-4 mb-6 grid grid-cols-1 md:grid-cols-4 gap-4">
+        <select
+          value={filters.status}
+          onChange={(e) => setFilters({ ...filters, status: e.target.value })}
+          className="border border-gray-300 rounded-md p-2 text-sm"
+        >
+          <option value="">Todos os status</option>
+          <option value="autorizado">Autorizada</option>
+          <option value="processando">Processando</option>
+          <option value="cancelado">Cancelada</option>
+          <option value="erro_autorizacao">Erro</option>
+        </select>
+        <input
+          type="date"
+          value={filters.date_from}
+          onChange={(e) => setFilters({ ...filters, date_from: e.target.value })}
+          className="border border-gray-300 rounded-md p-2 text-sm"
+          title="De"
+        />
+        <input
+          type="date"
+          value={filters.date_to}
+          onChange={(e) => setFilters({ ...filters, date_to: e.target.value })}
+          className="border border-gray-300 rounded-md p-2 text-sm"
+          title="Até"
+        />
+        <input
+          type="text"
+          value={filters.recipient}
+          onChange={(e) => setFilters({ ...filters, recipient: e.target.value })}
+          placeholder="Destinatário"
+          className="border border-gray-300 rounded-md p-2 text-sm"
+        />
+      </div>
+
       <div className="bg-white rounded-lg shadow overflow-hidden">
         <div className="overflow-x-auto">
           <table className="min-w-full divide-y divide-gray-200">
@@ -136,23 +277,21 @@ export function Financial() {
                       {invoice.recipient_name}
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
-                      {new Intl.NumberFormat('pt-BR', { style: 'currency', currency: 'BRL' }).format(invoice.total_value)}
+                      {formatCurrency(invoice.total_value)}
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap">
                       {getStatusBadge(invoice.status)}
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap text-right text-sm font-medium">
                       <div className="flex justify-end space-x-3">
-                        {invoice.pdf_url && (
-                          <a
-                            href={invoice.pdf_url}
-                            target="_blank"
-                            rel="noopener noreferrer"
+                        {invoice.status === 'autorizado' && (
+                          <button
+                            onClick={() => openPdf(invoice)}
                             className="text-blue-600 hover:text-blue-900"
                             title="Visualizar PDF"
                           >
                             <FileText size={18} />
-                          </a>
+                          </button>
                         )}
 
                         {invoice.status === 'autorizado' && (
@@ -172,6 +311,17 @@ export function Financial() {
             </tbody>
           </table>
         </div>
+        {nextCursor && !loading && (
+          <div className="p-4 border-t border-gray-200 text-center">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="px-4 py-2 border border-gray-300 rounded-md text-sm font-medium text-gray-700 hover:bg-gray-50 disabled:opacity-50"
+            >
+              {loadingMore ? 'Carregando...' : 'Carregar mais'}
+            </button>
+          </div>
+        )}
       </div>
 
       {/* Modal de Cancelamento */}
@@ -110,7 +110,7 @@ const ManualInvoice = () => {
 
       const result = await api.issueManualInvoice(payload);
       setResponse(result);
-      setSuccess('Nota Fiscal emitida com sucesso!');
+      setSuccess('Nota Fiscal enviada para processamento! Acompanhe o status no Financeiro.');
     } catch (err: any) {
       setError(err.message);
       console.error(err);
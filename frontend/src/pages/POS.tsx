@@ -36,10 +36,29 @@ const POS = ({ onSaleComplete }: POSProps) => {
     }
   };
 
-  // Filter products based on search
-  const filteredProducts = products.filter(item =>
-    item.name.toLowerCase().includes(searchQuery.toLowerCase())
-  );
+  // Search on the server (full-text index), debounced while the cashier types
+  const [searchResults, setSearchResults] = useState<Product[] | null>(null);
+
+  useEffect(() => {
+    const query = searchQuery.trim();
+    if (!query) {
+      setSearchResults(null);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        setSearchResults(await api.searchProducts(query));
+      } catch (error) {
+        console.error('Error searching products:', error);
+      }
+    }, 150);
+    return () => clearTimeout(timer);
+  }, [searchQuery]);
+
+  const filteredProducts = searchResults ?? products;
+
+  const findProduct = (productId: number) =>
+    filteredProducts.find(p => p.id === productId) ?? products.find(p => p.id === productId);
 
   // Add product to cart
   const addToCart = (productId: number) => {
@@ -48,7 +67,7 @@ const POS = ({ onSaleComplete }: POSProps) => {
       return;
     }
 
-    const product = products.find(p => p.id === productId);
+    const product = findProduct(productId);
     if (!product) return;
 
     if (product.quantity <= 0) {
@@ -85,7 +104,7 @@ const POS = ({ onSaleComplete }: POSProps) => {
       return;
     }
 
-    const product = products.find(p => p.id === productId);
+    const product = findProduct(productId);
     if (!product) return;
 
     if (newQuantity > product.quantity) {
@@ -124,11 +143,11 @@ const POS = ({ onSaleComplete }: POSProps) => {
         quantity: item.quantityInCart
       }));
 
-      await api.processSale(saleItemsPayload);
+      const result = await api.processSale(saleItemsPayload);
 
-      const total = calculateTotal();
+      const total = result.total;
 
-      // Create sale record for history (frontend only for now)
+      // Sale is persisted by the backend; keep a local copy for the history view
       const saleItems: SaleItem[] = cart.map(item => ({
         id: String(item.id),
         name: item.name,
@@ -138,8 +157,8 @@ const POS = ({ onSaleComplete }: POSProps) => {
       }));
 
       const sale: Sale = {
-        id: `sale-${Date.now()}`,
-        date: new Date().toISOString(),
+        id: String(result.sale_id),
+        date: result.date,
         items: saleItems,
         total: total,
         fiscalStatus: 'Pendente',
@@ -2,17 +2,41 @@ import type { Product, CompanySettings } from '../types';
 
 const BASE_URL = 'http://localhost:8000';
 
+// Every call carries the token saved at login: the backend takes the branch
+// (tenant) from it, and requests without it fall back to the default branch
+export const authFetch = async (input: string, init: RequestInit = {}): Promise<Response> => {
+  const token = localStorage.getItem('token');
+  const headers = new Headers(init.headers);
+  if (token) headers.set('Authorization', `Bearer ${token}`);
+  const response = await fetch(input, { ...init, headers });
+  if (response.status === 401 && token) {
+    // Expired or revoked: back to the login screen
+    localStorage.removeItem('token');
+    window.location.reload();
+  }
+  return response;
+};
+
 export const api = {
   getProducts: async (): Promise<Product[]> => {
-    const response = await fetch(`${BASE_URL}/products/`);
+    const response = await authFetch(`${BASE_URL}/products/`);
     if (!response.ok) {
       throw new Error('Failed to fetch products');
     }
     return response.json();
   },
 
+  searchProducts: async (q: string, limit = 20): Promise<Product[]> => {
+    const params = new URLSearchParams({ q, limit: String(limit) });
+    const response = await authFetch(`${BASE_URL}/products/search?${params}`);
+    if (!response.ok) {
+      throw new Error('Failed to search products');
+    }
+    return response.json();
+  },
+
   createProduct: async (data: { name: string; quantity: number; price: number; ncm: string }): Promise<Product> => {
-    const response = await fetch(`${BASE_URL}/products/`, {
+    const response = await authFetch(`${BASE_URL}/products/`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -26,7 +50,7 @@ export const api = {
   },
 
   getCompanySettings: async (): Promise<CompanySettings> => {
-    const response = await fetch(`${BASE_URL}/settings/company`);
+    const response = await authFetch(`${BASE_URL}/settings/company`);
     if (response.status === 404) {
       // Return empty default if not found
       return {
@@ -40,7 +64,7 @@ export const api = {
   },
 
   saveCompanySettings: async (data: CompanySettings): Promise<CompanySettings> => {
-    const response = await fetch(`${BASE_URL}/settings/company`, {
+    const response = await authFetch(`${BASE_URL}/settings/company`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify(data),
@@ -49,20 +73,21 @@ export const api = {
     return response.json();
   },
 
-  processSale: async (items: { product_id: number; quantity: number }[]): Promise<void> => {
-    const response = await fetch(`${BASE_URL}/sales`, {
+  processSale: async (items: { product_id: number; quantity: number }[]): Promise<{ sale_id: number; date: string; total: number }> => {
+    const response = await authFetch(`${BASE_URL}/sales`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ items }),
     });
     if (!response.ok) {
       const error = await response.json();
-      throw new Error(error.detail || 'Failed to process sale');
+      throw new Error(error.detail?.message || error.detail || 'Failed to process sale');
     }
+    return response.json();
   },
 
   emitFiscalDocument: async (sale: any): Promise<any> => {
-    const response = await fetch(`${BASE_URL}/fiscal/emit`, {
+    const response = await authFetch(`${BASE_URL}/fiscal/emit`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -77,7 +102,7 @@ export const api = {
   },
 
   issueManualInvoice: async (data: any): Promise<any> => {
-    const response = await fetch(`${BASE_URL}/fiscal/issue-manual`, {
+    const response = await authFetch(`${BASE_URL}/fiscal/issue-manual`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify(data),